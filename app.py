@@ -2,19 +2,20 @@
 # coding: utf-8
 # Config
 
+# Heavy modules (spaCy, sklearn, NLTK, deep_translator) and data are only
+# loaded by the features that use them, so the UI renders right away.
 import streamlit as st
-import random
-import numpy as np
-import spacy
 
-import pickle
+import contextlib
 import os
 
-import nltk
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+from src import resources
+from src.scoring import TTLCache, level_name, text_hash
+from src import profiling
 
-from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+# Results of the operations and predictions kept across reruns and sessions
+RESULTS_MAXSIZE = 1024
+RESULTS_TTL = 3600
 
 # Program
 class App():
@@ -25,12 +26,12 @@ class App():
         self.language = self.select_language()
         self.show_description()
         self.get_text()
-        self.load_spacy()
         self.get_classifier()
         self.get_operation()
         self.apply_operation()
         self.load_pipeline()
         self.predict_level()
+        self.show_profiling()
 
     @staticmethod
     def show_logo():
@@ -63,9 +64,6 @@ You can also find out how NLP (Natural Language Processing) operations can influ
         self.original_text = text
         self.text = text
 
-    def load_spacy(self):
-        self.spacy_nlp = spacy.load("pt_core_news_sm")
-
     def get_classifier(self):
         models = ['Naive Bayes (NB)', 'Support Vector Classifier (SVC)']
         if self.language == 'Português':
@@ -75,12 +73,8 @@ You can also find out how NLP (Natural Language Processing) operations can influ
         name = st.sidebar.selectbox(label=label, options=models)
 
         if name == 'Naive Bayes (NB)':
-            from sklearn.naive_bayes import MultinomialNB
-            self.clf = MultinomialNB()
             self.code = 'NB'
         else:
-            from sklearn.svm import LinearSVC
-            self.clf = LinearSVC(C=1.0, random_state=21)
             self.code = 'SVC'
 
     def get_operation(self):
@@ -97,152 +91,58 @@ You can also find out how NLP (Natural Language Processing) operations can influ
         """
         Get synonyms of a word
         """
-        from nltk.corpus import wordnet 
+        from src.synonyms import get_synonyms
 
-        synonyms = set()
-        
-        for syn in wordnet.synsets(word, lang='por'): 
-            for l in syn.lemmas(lang='por'): 
-                synonym = l.name().replace("_", " ").replace("-", " ").lower()
-                synonym = "".join([char for char in synonym if char in ' qwertyuiopasdfghjklçzxcvbnmáàãâéêíóõôúü'])
-                synonyms.add(synonym) 
-        
-        if word in synonyms:
-            synonyms.remove(word)
-        
-        return list(synonyms)
+        return get_synonyms(word)
     
-    def synonym_replacement(self, words, stop_words, n):
-        if n <= 0: # no word to replace, return the original text
-            return words
-            
-        words = words.split()
-        
-        new_words = words.copy()
-        random_word_list = list(set([word for word in words if word not in stop_words]))
-        random.shuffle(random_word_list)
-        num_replaced = 0
-        
-        for random_word in random_word_list:
-            synonyms = self.get_synonyms(random_word)
-            
-            if len(synonyms) >= 1:
-                synonym = random.choice(list(synonyms))
-                new_words = [synonym if word == random_word else word for word in new_words]
-                num_replaced += 1
-            
-            if num_replaced >= n: #only replace up to n words
-                break
-
-        sentence = ' '.join(new_words)
-
-        return sentence
+    def synonym_replacement(self, words, stop_words, n, seed=None):
+        import random
+        from src.operations import synonym_replacement
+
+        return synonym_replacement(words, stop_words, n, random.Random(seed), get_synonyms=self.get_synonyms)
     
     def swap_gender(self, text):
-        # map of pronouns
-        gen_map = {
-            'ele': 'ela', 
-            'ela': 'ele', 
-            'eles': 'elas', 
-            'elas': 'eles', 
-            'meu': 'minha', 
-            'minha': 'meu', 
-            'meus': 'minhas', 
-            'minhas': 'meus', 
-            'teu': 'tua', 
-            'tua': 'teu', 
-            'teus': 'tuas', 
-            'tuas': 'teus', 
-            'seu': 'sua', 
-            'sua': 'seu', 
-            'seus': 'suas', 
-            'suas': 'seus', 
-            'este': 'esta', 
-            'esta': 'este', 
-            'estes': 'estas', 
-            'estas': 'estes', 
-            'esse': 'essa', 
-            'essa': 'esse', 
-            'esses': 'essas', 
-            'essas': 'esses', 
-            'aquele': 'aquela', 
-            'aquela': 'aquele', 
-            'aqueles': 'aquelas', 
-            'aquelas': 'aqueles', 
-            'àquele': 'àquela', 
-            'àquela': 'àquele', 
-            'àqueles': 'àquelas', 
-            'àquelas': 'àqueles', 
-            'mesmo': 'mesma', 
-            'mesma': 'mesmo', 
-            'mesmos': 'mesmas', 
-            'mesmas': 'mesmos', 
-            'próprio': 'própria', 
-            'própria': 'próprio', 
-            'próprios': 'próprias', 
-            'próprias': 'próprios', 
-            'todo': 'toda', 
-            'toda': 'todo', 
-            'todos': 'todas', 
-            'todas': 'todos', 
-            'algum': 'alguma', 
-            'alguma': 'algum', 
-            'alguns': 'algumas', 
-            'algumas': 'alguns', 
-            'um': 'uma', 
-            'uma': 'um', 
-            'uns': 'umas', 
-            'umas': 'uns', 
-            'certo': 'certa', 
-            'certa': 'certo', 
-            'certos': 'certas', 
-            'certas': 'certos', 
-            'vários': 'várias', 
-            'várias': 'vários', 
-            'muito': 'muita', 
-            'muita': 'muito', 
-            'muitos': 'muitas', 
-            'muitas': 'muitos', 
-            'quanto': 'quanta', 
-            'quanta': 'quanto', 
-            'quantos': 'quantas', 
-            'quantas': 'quantos', 
-            'tanto': 'tanta', 
-            'tanta': 'tanto', 
-            'tantos': 'tantas', 
-            'tantas': 'tantos', 
-            'outro': 'outra', 
-            'outra': 'outro', 
-            'outros': 'outras', 
-            'outras': 'outros', 
-        }
-        
-        word_list = []
+        from src.operations import swap_gender
 
-        for token in self.spacy_nlp(text):
-            word = token.text
-            if word in gen_map.keys():
-                word = gen_map[word]
-            word_list.append(word)
-            
-        sentence = ' '.join(word_list)
-        return sentence
+        return swap_gender(text)
+
+    @staticmethod
+    def cached(key, compute):
+        """
+        Return the result of `compute()` stored under `key`, computing it only when
+        it is not in the process-wide results cache (or has expired).
+        """
+        results = resources.CACHE.get(('app', 'results'), lambda: TTLCache(RESULTS_MAXSIZE, RESULTS_TTL))
+        result = results.get(key)
+        if result is None:
+            result = compute()
+            results[key] = result
+        return result
 
     def apply_operation(self):
         if not self.original_text:
             return
+        key = text_hash(self.original_text)
         st.write(f'### {self.operation}')
         if self.operation == 'Troca de palavras' or self.operation == 'Word swap':
-            stop_words = self.spacy_nlp.Defaults.stop_words
             if self.language == 'Português':
                 slider_label = '% de palavras trocadas'
                 label = 'Texto após a troca de palavras'
+                seed_label = 'Semente aleatória'
             else:
                 slider_label = '% of words that will be swapped'
                 label = 'Text after swapping words'
+                seed_label = 'Random seed'
             percent = st.sidebar.slider(label, 0.0, 1.0, value=0.5)
+            seed = int(st.sidebar.number_input(seed_label, min_value=0, value=0, step=1))
             num_change = int(percent * len(self.original_text))
-            self.text = self.synonym_replacement(self.original_text, stop_words, num_change)
+
+            def swap_words():
+                # the stop words of the Portuguese language data, no spaCy model is loaded
+                from spacy.lang.pt.stop_words import STOP_WORDS
+
+                return self.synonym_replacement(self.original_text, STOP_WORDS, num_change, seed)
+            self.text = self.cached((key, 'word_swap', num_change, seed), swap_words)
             st.write(f'**{label}**')
             st.write(f'_{self.text}_')
         elif self.operation == 'Troca de gênero' or self.operation == 'Gender swap':
@@ -252,13 +152,13 @@ You can also find out how NLP (Natural Language Processing) operations can influ
             else:
                 st.warning('At the moment, only pronouns are exchanged!')
                 label = 'Text after swapping gender'
-            self.text = self.swap_gender(self.original_text)
+            self.text = self.cached((key, 'gender_swap'), lambda: self.swap_gender(self.original_text))
             st.write(f'**{label}**')
             st.write(f'_{self.text}_')
         
-        elif self.operation == 'Paráfrase':
-            from deep_translator import GoogleTranslator
-            
+        elif self.operation == 'Paráfrase' or self.operation == 'Paraphrase':
+            from src.paraphrase import get_paraphraser
+
             if self.language == 'Português':
                 st.write('Alteração da escrita por meio da tradução reversa com a API do Google Tradutor')
                 label1 = 'Texto em inglês'
@@ -267,8 +167,15 @@ You can also find out how NLP (Natural Language Processing) operations can influ
                 st.write('Change of writing through reverse translation with Google Translate API')
                 label1 = 'Text in English'
                 label2 = 'Text translated back into Portuguese'
-            translated = GoogleTranslator(source='pt', target='en').translate(self.original_text)
-            back_translated = GoogleTranslator(source='en', target='pt').translate(translated)
+            # translations are also cached on disk, so restarts with the same text skip the API
+            translated, back_translated = self.cached((key, 'paraphrase'),
+                                                      lambda: get_paraphraser().paraphrase(self.original_text))
+            if back_translated is None:
+                if self.language == 'Português':
+                    st.warning('Texto longo demais para ser traduzido.')
+                else:
+                    st.warning('Text too long to be translated.')
+                return
             self.text = back_translated
             st.write(f'**{label1}**')
             st.write(f'_{translated}_')
@@ -283,37 +190,69 @@ You can also find out how NLP (Natural Language Processing) operations can influ
 
     def load_pipeline(self):
         path = 'pickle'
-        if os.path.isdir(path):
-            # Read the classifier from pickle
-            with open(f'{path}/pipeline_{self.code}.pickle', 'rb') as file:
-                self.pipe = pickle.load(file)
+        # nothing to classify yet, do not load spaCy and the classifier
+        if self.text and os.path.isdir(path):
+            # Read the classifier from pickle, reusing the copy already loaded by this process
+            self.pipe, self.pipe_version = resources.get_versioned_pipeline(self.code, path)
 
     def predict_level(self):
+        if self.language == 'Português':
+            incremental = st.sidebar.checkbox('Análise incremental (por frase)')
+        else:
+            incremental = st.sidebar.checkbox('Incremental analysis (by sentence)')
         if not self.text:
             return
-        X_test = [self.text]
-        y_pred = self.pipe.predict(X_test)
-        predicted_level = int(y_pred[0])
+
+        def predict():
+            with profiling.stage('pipeline.predict'):
+                # same predictions as self.pipe.predict, without the intermediate matrices
+                compiled = resources.get_compiled(self.code, 'pickle')
+                if incremental:
+                    return self.predict_incremental(compiled)
+                # the lemmatized text is shared by the classifiers, switching them does not run spaCy again
+                features = resources.get_feature_cache(compiled.lemmatizer)
+                return int(compiled.predict_lemmatized(features.transform([self.text]))[0])
+        # the version of the model files identifies the loaded classifier; the incremental
+        # predictions are the same as the whole-text ones, so they share the key
+        key = (text_hash(self.text), 'level', self.code, self.pipe_version)
+        predicted_level = self.cached(key, predict)
         if self.language == 'Português':
             st.write('### Seu nível de escrita classificado é: ')
-            if predicted_level == 1:
-                st.write('Ensino Fundamental I')
-            elif predicted_level == 2:
-                st.write('Ensino Fundamental II')
-            elif predicted_level == 3:
-                st.write('Ensino Médio')
-            else:
-                st.write('Ensino Superior')
         else:
             st.write('### Your graded writing level is: ')
-            if predicted_level == 1:
-                st.write('Elementary School I')
-            elif predicted_level == 2:
-                st.write('Elementary School II')
-            elif predicted_level == 3:
-                st.write('High School')
-            else:
-                st.write('Higher Education')
+        st.write(level_name(predicted_level, self.language))
+
+    def predict_incremental(self, compiled):
+        """Predict with the IncrementalScorer of this session, which only lemmatizes
+        the sentences changed since the previous version of the text
+        """
+        from src.incremental import IncrementalScorer
+
+        key = f'incremental_{self.code}'
+        scorer = st.session_state.get(key)
+        if scorer is None or scorer.compiled is not compiled:
+            scorer = IncrementalScorer(self.pipe, compiled)
+            st.session_state[key] = scorer
+        return int(scorer.predict(self.text))
+
+    def show_profiling(self):
+        """Optional sidebar panel with the timings of the hot paths of this process"""
+        if self.language == 'Português':
+            labels = ('Perfil de desempenho', 'Medir memória (tracemalloc)', 'cProfile da próxima execução')
+        else:
+            labels = ('Profiling', 'Trace memory (tracemalloc)', 'cProfile the next run')
+        if not st.sidebar.checkbox(labels[0]):
+            return
+        # read by main() at the start of the next runs
+        st.sidebar.checkbox(labels[1], key='trace_memory')
+        st.sidebar.checkbox(labels[2], key='cprofile')
+        import json
+        import pandas as pd
+
+        snapshot = profiling.snapshot()
+        st.sidebar.dataframe(pd.DataFrame.from_dict(snapshot, orient='index').round(2))
+        st.sidebar.download_button('JSON', json.dumps(snapshot, indent=1), file_name='profile.json',
+                                   mime='application/json')
 
     def copyright_note(self):
         st.markdown('----------------------------------------------------')
@@ -323,9 +262,23 @@ You can also find out how NLP (Natural Language Processing) operations can influ
             st.markdown('Created by Caio Cedrola Rocha, 2022.')
 
 def main():
-    # Create App
-    app = App()
-        
+    # Memory is only traced while the runs of the sessions that ask for it execute,
+    # so a session that is closed with the box checked does not leave it on
+    if st.session_state.get('trace_memory'):
+        tracing = profiling.PROFILER.memory_tracing()
+    else:
+        tracing = contextlib.nullcontext()
+    # Create App, under cProfile when requested in the profiling panel
+    with tracing:
+        if st.session_state.get('cprofile'):
+            # a single run is profiled: the box is unchecked before the app renders it again
+            st.session_state['cprofile'] = False
+            app, report = profiling.profile_call(App)
+            with st.expander('cProfile'):
+                st.text(report)
+        else:
+            app = App()
+
     # Copyright footnote
     app.copyright_note()
 
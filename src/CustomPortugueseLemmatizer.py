@@ -1,30 +1,81 @@
+import re
+
+from src.profiling import stage
+
+CONSONANTS = 'bcdfghjklmnpqrstvwxyzç'
+VOWELS = 'aeiouáàãâéêíóõôúü'
+
+# Phonotactic features of a lemma, emitted as 'is_<name>' or 'not_<name>' tokens.
+# Each pattern must match the whole lemma.
+PHONOTACTIC_FEATURES = {
+    # only CV (consonant-vowel) syllables
+    'cv': re.compile(f'(?:[{CONSONANTS}][{VOWELS}])*'),
+    # has a CCV syllable, a consonant cluster ending in l or r followed by a vowel (e.g. "pra", "blo")
+    'ccv': re.compile(f'.*[bcdfgkptv][lr][{VOWELS}].*'),
+    # starts with a vowel
+    'vinit': re.compile(f'[{VOWELS}].*'),
+}
+
+# Lookup tables of the features already computed for each lemma, since lemmas repeat a lot
+# across documents. They are cleared when they reach MAX_LOOKUP_SIZE entries.
+MAX_LOOKUP_SIZE = 200000
+_lookup_tables = {feature: {} for feature in PHONOTACTIC_FEATURES}
+
+
 class CustomPortugueseLemmatizer():
     """Canonicalize a dataset by applying lemmatization to texts
     in the portuguese language with Spacy's "pt_core_news_sm" module
     """
-    def __init__(self):
-        import spacy
-        self.spacy_nlp = spacy.load("pt_core_news_sm")
+    spacy_model = "pt_core_news_sm"
+    # Class-level defaults, so lemmatizers unpickled from older pipelines also have them
+    batch_size = 64
+    n_process = 1
+    phonotactic_features = ('cv',)
+
+    def __init__(self, batch_size=64, n_process=1, phonotactic_features=('cv',)):
+        self.spacy_nlp = self.load_spacy()
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.phonotactic_features = tuple(phonotactic_features)
+
+    def load_spacy(self):
+        from src.resources import get_spacy
+        return get_spacy(self.spacy_model, profile='lemmatizer')
+
+    # The spaCy model is not pickled: it is attached again by name when unpickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('spacy_nlp', None)
+        return state
+
+    def __setstate__(self, state):
+        state.pop('spacy_nlp', None)
+        self.__dict__.update(state)
+        self.spacy_nlp = self.load_spacy()
     
     # Returns True if the word is in CV (consonant-vowel) format or False if it is not
     def is_canonical(self, word):
-        canonical = True
-        seq = iter(word)
+        # shares the lookup table of phonotactic_list, repeated words skip the regex
+        value = _lookup_tables['cv'].get(word)
+        if value is None:
+            value = CustomPortugueseLemmatizer.phonotactic_list([word])[0]
+        return value == 'is_cv'
 
-        for c in seq:
-            if c not in 'bcdfghjklmnpqrstvwxyzç':
-                canonical = False
-                break
-            else:
-                try:
-                    n = next(seq)
-                except StopIteration as e:
-                    canonical = False
-                    break
-                if n not in 'aeiouáàãâéêíóõôúü':
-                    canonical = False
-                    break
-        return canonical
+    @staticmethod
+    def phonotactic_list(words, feature='cv'):
+        """Return 'is_<feature>' or 'not_<feature>' for each word of a list"""
+        table = _lookup_tables[feature]
+        if len(table) >= MAX_LOOKUP_SIZE:
+            table.clear()
+        match = PHONOTACTIC_FEATURES[feature].fullmatch
+        is_feature, not_feature = 'is_' + feature, 'not_' + feature
+        result = []
+        for word in words:
+            value = table.get(word)
+            if value is None:
+                value = table[word] = is_feature if match(word) else not_feature
+            result.append(value)
+        return result
     
     def remove_case(self, token):
         return (
@@ -40,26 +91,44 @@ class CustomPortugueseLemmatizer():
     def fit(self, raw_documents, y=None):
         return self
     
-    def transform(self, raw_documents):
-        X = []
-        for text in raw_documents:
-            word_list = []
-            cv_list = []
-            for token in self.spacy_nlp(text):
-                # only append useful words, excluding stop words, numbers, 
-                # spaces, punctuations, symbols and unknown characters
-                if not self.remove_case(token): 
-                    word = token.lemma_.lower()
-                    word_list.append(word)
-                    # assign if word is in CV (consonant-vowel) format or if it is not defined
-                    # word = word + '_cv' if is_canonical(word) else word + '_nd'
-                    cv_list.append('is_cv' if self.is_canonical(word) else 'not_cv')
+    def features(self, doc):
+        """Return the lemma list and the CV feature list of a spaCy Doc"""
+        # only append useful words, excluding stop words, numbers, 
+        # spaces, punctuations, symbols and unknown characters
+        word_list = [token.lemma_.lower() for token in doc if not self.remove_case(token)]
+        # assign if word is in CV (consonant-vowel) format or if it is not defined,
+        # followed by the other phonotactic features, if any
+        cv_list = []
+        for feature in self.phonotactic_features:
+            cv_list += self.phonotactic_list(word_list, feature)
+        return word_list, cv_list
+
+    @staticmethod
+    def join_features(word_list, cv_list):
+        sentence = ' '.join(word_list)
+        sentence += ' '
+        sentence += ' '.join(cv_list)
+        return sentence
 
-            sentence = ' '.join(word_list)
-            sentence += ' '
-            sentence += ' '.join(cv_list)
-            X.append(sentence)
-        return X
+    def pipe_features(self, raw_documents, batch_size=None, n_process=None):
+        """Lazily yield the (word_list, cv_list) of the documents, processing them in
+        batches with spaCy's `nlp.pipe` (and in `n_process` worker processes if > 1)
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        if n_process is None:
+            n_process = self.n_process
+        for doc in self.spacy_nlp.pipe(raw_documents, batch_size=batch_size, n_process=n_process):
+            yield self.features(doc)
+
+    def pipe(self, raw_documents, batch_size=None, n_process=None):
+        """Lazily yield the transformed documents, see `pipe_features`"""
+        for word_list, cv_list in self.pipe_features(raw_documents, batch_size, n_process):
+            yield self.join_features(word_list, cv_list)
+    
+    def transform(self, raw_documents):
+        with stage('lemmatizer.transform'):
+            return list(self.pipe(raw_documents))
     
     def fit_transform(self, raw_documents, y=None):
         return self.fit(raw_documents, y).transform(raw_documents)
\ No newline at end of file
@@ -0,0 +1,461 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Benchmarks of the hot paths of the app and the notebooks.
+Run from the root of the repository, e.g.:
+
+    python -m src.benchmarks lemmatizer --dataset dataset.csv --limit 500
+"""
+import argparse
+import os
+import time
+
+
+def measure(function, repeat=3):
+    """Return the result of `function()` and its best wall time out of `repeat` runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def report(name, seconds, items=None, unit='docs'):
+    line = f'{name:<40s} {seconds * 1000:10.2f} ms'
+    if items:
+        line += f' {items / seconds:12.1f} {unit}/s'
+    print(line)
+
+
+def load_texts(dataset, limit=None):
+    import pandas as pd
+
+    df = pd.read_csv(dataset, index_col='id', nrows=limit)
+    return df['text'].tolist()
+
+
+def bench_lemmatizer(args):
+    """Compare the per-document lemmatization loop with the batched `nlp.pipe` path"""
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+    texts = load_texts(args.dataset, args.limit)
+    lem = CustomPortugueseLemmatizer()
+
+    # previous implementation of transform: one nlp() call per document
+    def per_document():
+        return [lem.join_features(*lem.features(lem.spacy_nlp(text))) for text in texts]
+
+    expected, seconds = measure(per_document, args.repeat)
+    report('per document', seconds, len(texts))
+
+    for n_process in args.n_process:
+        for batch_size in args.batch_size:
+            output, seconds = measure(lambda: list(lem.pipe(texts, batch_size, n_process)), args.repeat)
+            report(f'nlp.pipe batch_size={batch_size} n_process={n_process}', seconds, len(texts))
+            if output != expected:
+                raise AssertionError(f'nlp.pipe output differs (batch_size={batch_size}, n_process={n_process})')
+
+
+def bench_profiles(args):
+    """Compare the full spaCy model with the 'lemmatizer' profile and check
+    that the lemmatizer features are identical
+    """
+    import tracemalloc
+    from src import resources
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+    texts = load_texts(args.dataset, args.limit)
+    outputs = {}
+    for profile in ('full', 'lemmatizer'):
+        tracemalloc.start()
+        nlp, seconds = measure(lambda: resources.get_spacy(profile=profile), repeat=1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{profile} profile: {nlp.pipe_names}, loaded in {seconds:.2f} s, {peak / 2**20:.1f} MiB allocated')
+
+        lem = CustomPortugueseLemmatizer()
+        lem.spacy_nlp = nlp
+        outputs[profile], seconds = measure(lambda: lem.transform(texts), args.repeat)
+        report(f'transform ({profile} profile)', seconds, len(texts))
+
+    tokenizer = resources.get_spacy(profile='tokenizer')
+    _, seconds = measure(lambda: [[token.text for token in tokenizer(text)] for text in texts], args.repeat)
+    report('tokenizer profile', seconds, len(texts))
+
+    if outputs['full'] != outputs['lemmatizer']:
+        raise AssertionError('lemmatizer features differ between the full model and the lemmatizer profile')
+    print('lemmatizer features are identical')
+
+
+def bench_synonyms(args):
+    """Compare WordNet synonym lookups with the precomputed synonym index"""
+    from src.synonyms import SynonymIndex, wordnet_synonyms
+
+    words = [word for text in load_texts(args.dataset, args.limit) for word in text.split()]
+    index = SynonymIndex(args.index)
+    if not os.path.exists(args.index):
+        raise SystemExit(f'{args.index} not found, build it with `python -m src.synonyms build`')
+
+    # previous implementation of get_synonyms: a WordNet traversal per word
+    def wordnet_lookup():
+        return [sorted(wordnet_synonyms(word) - {word}) for word in words]
+
+    expected, seconds = measure(wordnet_lookup, repeat=1)
+    report('wordnet', seconds, len(words), unit='words')
+    output, seconds = measure(lambda: [index.get_synonyms(word) for word in words], repeat=1)
+    report('index (cold)', seconds, len(words), unit='words')
+    _, seconds = measure(lambda: [index.get_synonyms(word) for word in words], args.repeat)
+    report('index (warm)', seconds, len(words), unit='words')
+    print(index.cache_info())
+
+    if output != expected:
+        raise AssertionError('the synonym index differs from WordNet')
+
+
+# Inputs and outputs of the text cleaning, from the original implementation
+CLEANING_GOLDEN = [
+    ('This is her \\ first day at this place.\n Please,\t Be nice to her.\\n',
+     'This is her first day at this place. Please, Be nice to her. '),
+    ('This is a nice place to live. <IMG>', 'This is a nice place to live. '),
+    ('To know more about this website: kajalyadav.com  visit: https://kajalyadav.com//Blogs',
+     'To know more about this website: visit: '),
+    ('How   are   you   doing   ?', 'How are you doing  ? '),
+    ("\ufeff I'm great!", "I'm great!"),
+    ('Fish &amp; chips <b>(bold)</b>? yes.\tno', 'Fish & chips (bold)   ?  yes. no'),
+    ('   Ele disse:(oi)tudo bem?Sim. com certeza', 'Ele disse:(oi) tudo bem ? Sim.com certeza'),
+    ('', ''),
+]
+
+
+def legacy_cleaning_stages():
+    """Previous implementation of the cleaning stages of dataset_to_csv"""
+    import re
+    from src.dataset_to_csv import strip_html_tags
+
+    def remove_newlines_tabs(text):
+        return text.replace('\\n', ' ').replace('\n', ' ').replace('\t',' ').replace('\\', ' ').replace('. com', '.com')
+
+    def remove_links(text):
+        return re.sub(r"\ [A-Za-z]*\.com", " ", re.sub(r'http\S+', '', text))
+
+    def remove_non_printable(text):
+        return re.sub(r'[^\w\s"\'!@#$%&*()-_+=\[\]{}:;.,|]+', '', text)
+
+    def remove_whitespace(text):
+        pattern = re.compile(r'\s+')
+        return re.sub(pattern, ' ', text.lstrip()).replace('?', ' ? ').replace(')', ') ')
+
+    return [remove_newlines_tabs, strip_html_tags, remove_links, remove_non_printable, remove_whitespace]
+
+
+def check_cleaning(args):
+    """Check the text cleaning against the golden outputs and the previous implementation
+    on generated texts (no dataset needed)
+    """
+    import random
+    import warnings
+    from src import dataset_to_csv
+
+    # BeautifulSoup warns about the inputs that look like URLs
+    warnings.simplefilter('ignore')
+    for text, expected in CLEANING_GOLDEN:
+        if dataset_to_csv.cleaning(text) != expected:
+            raise AssertionError(f'cleaning({text!r}) != {expected!r}')
+        if dataset_to_csv.cleaning_stages(text) != expected:
+            raise AssertionError(f'cleaning_stages({text!r}) != {expected!r}')
+    print('golden outputs match')
+
+    # texts mixing the characters and fragments each stage handles
+    fragments = ['a', 'Ele', ' ', '  ', '\n', '\\n', '\t', '\\', '.', '. com', '?', ')', '(', '<b>', '</b>',
+                 '&amp;', '&', '<', 'http://x.com/a', ' site.com', '\ufeff', '\u200b', 'ç', 'é', '1', '"', "'"]
+    rng = random.Random(args.seed)
+    legacy = legacy_cleaning_stages()
+    for _ in range(args.texts):
+        text = ''.join(rng.choice(fragments) for _ in range(rng.randint(0, 30)))
+        expected = text
+        for stage in legacy:
+            expected = stage(expected)
+        if dataset_to_csv.cleaning(text) != expected:
+            raise AssertionError(f'cleaning({text!r}) differs from the previous implementation')
+    print(f'cleaning matches the previous implementation on {args.texts} generated texts')
+
+
+def bench_cleaning(args):
+    """Time each stage of the text cleaning against its previous implementation"""
+    from src import dataset_to_csv
+
+    lines = [line + '\n' for text in load_texts(args.dataset, args.limit) for line in text.split('. ')]
+    stages = [dataset_to_csv.remove_newlines_tabs, dataset_to_csv.strip_html_tags, dataset_to_csv.remove_links,
+              dataset_to_csv.remove_non_printable, dataset_to_csv.remove_whitespace]
+    for legacy, stage in zip(legacy_cleaning_stages(), stages):
+        _, before = measure(lambda: [legacy(line) for line in lines], args.repeat)
+        _, after = measure(lambda: [stage(line) for line in lines], args.repeat)
+        print(f'{stage.__name__:<25s} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms ({before / after:.1f}x)')
+
+    expected, before = measure(lambda: [dataset_to_csv.cleaning_stages(line) for line in lines], args.repeat)
+    output, after = measure(lambda: [dataset_to_csv.cleaning(line) for line in lines], args.repeat)
+    print(f'{"cleaning":<25s} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms ({before / after:.1f}x)')
+    if output != expected:
+        raise AssertionError('the fused cleaning differs from the cleaning stages')
+
+
+def legacy_is_canonical(word):
+    """Previous implementation of CustomPortugueseLemmatizer.is_canonical"""
+    canonical = True
+    seq = iter(word)
+
+    for c in seq:
+        if c not in 'bcdfghjklmnpqrstvwxyzç':
+            canonical = False
+            break
+        else:
+            try:
+                n = next(seq)
+            except StopIteration as e:
+                canonical = False
+                break
+            if n not in 'aeiouáàãâéêíóõôúü':
+                canonical = False
+                break
+    return canonical
+
+
+def bench_cv(args):
+    """Compare the CV-pattern detector with its previous implementation"""
+    import itertools
+    import random
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer, _lookup_tables
+
+    # every short string over consonants, vowels and other characters
+    alphabet = 'bçaãeAx1- '
+    for length in range(6):
+        for chars in itertools.product(alphabet, repeat=length):
+            word = ''.join(chars)
+            if CustomPortugueseLemmatizer.is_canonical(None, word) != legacy_is_canonical(word):
+                raise AssertionError(f'is_canonical({word!r}) differs')
+    print('is_canonical matches on all strings of up to 5 characters')
+
+    # lemma-like words with a Zipf distribution, as in real texts
+    rng = random.Random(0)
+    vocabulary = [''.join(rng.choice('bcdlmnprstvçaeiouãéô') for _ in range(rng.randint(2, 10)))
+                  for _ in range(args.vocabulary)]
+    words = rng.choices(vocabulary, weights=[1 / rank for rank in range(1, len(vocabulary) + 1)], k=args.words)
+
+    expected, seconds = measure(lambda: ['is_cv' if legacy_is_canonical(word) else 'not_cv' for word in words],
+                                args.repeat)
+    report('previous is_canonical', seconds, len(words), unit='words')
+    lem = CustomPortugueseLemmatizer.__new__(CustomPortugueseLemmatizer)
+    _, seconds = measure(lambda: ['is_cv' if lem.is_canonical(word) else 'not_cv' for word in words], args.repeat)
+    report('is_canonical (lookup table)', seconds, len(words), unit='words')
+    _lookup_tables['cv'].clear()
+    output, seconds = measure(lambda: lem.phonotactic_list(words), repeat=1)
+    report('phonotactic_list (cold)', seconds, len(words), unit='words')
+    _, seconds = measure(lambda: lem.phonotactic_list(words), args.repeat)
+    report('phonotactic_list (warm)', seconds, len(words), unit='words')
+    if output != expected:
+        raise AssertionError('phonotactic_list differs from is_canonical')
+
+
+def bench_paraphrase(args):
+    """Compare sequential uncached back-translation with the batched, cached paraphraser (local backend)"""
+    import tempfile
+    from src.paraphrase import LocalBackend, Paraphraser
+
+    texts = load_texts(args.dataset, args.limit)
+    backend = LocalBackend(latency_ms=args.latency_ms)
+
+    # previous implementation: two blocking round-trips per text
+    def sequential():
+        results = []
+        for text in texts:
+            translated = backend.translate(text, 'pt', 'en')
+            results.append((translated, backend.translate(translated, 'en', 'pt')))
+        return results
+
+    expected, seconds = measure(sequential, repeat=1)
+    report('sequential, uncached', seconds, len(texts))
+
+    with tempfile.TemporaryDirectory() as directory:
+        paraphraser = Paraphraser(backend, os.path.join(directory, 'cache.sqlite3'), max_workers=args.workers)
+        output, seconds = measure(lambda: paraphraser.paraphrase_batch(texts), repeat=1)
+        report(f'batched, workers={args.workers} (cold)', seconds, len(texts))
+        if output != expected:
+            raise AssertionError('paraphrase_batch differs from the sequential translation')
+        output, seconds = measure(lambda: paraphraser.paraphrase_batch(texts), args.repeat)
+        report('batched (warm cache)', seconds, len(texts))
+        if output != expected:
+            raise AssertionError('cached paraphrase_batch differs from the sequential translation')
+
+
+def bench_compiled(args):
+    """Compare pipe.predict with the compiled linear scorer, on single texts and on a batch"""
+    from src import resources
+    from src.compiled import CompiledLinearScorer
+
+    texts = load_texts(args.dataset, args.limit)
+    for code in args.classifier:
+        pipe = resources.get_pipeline(code, args.models)
+        compiled = CompiledLinearScorer.from_pipeline(pipe)
+        lemmatized = pipe.steps[0][1].transform(texts)
+        expected, seconds = measure(lambda: [pipe[1:].predict([text])[0] for text in lemmatized], args.repeat)
+        report(f'{code} pipe.predict, one text at a time', seconds, len(texts))
+        output, seconds = measure(lambda: [compiled.predict_lemmatized([text])[0] for text in lemmatized],
+                                  args.repeat)
+        report(f'{code} compiled, one text at a time', seconds, len(texts))
+        if output != expected:
+            raise AssertionError(f'{code}: compiled predictions differ')
+        expected, seconds = measure(lambda: pipe[1:].predict(lemmatized), args.repeat)
+        report(f'{code} pipe.predict, batch', seconds, len(texts))
+        output, seconds = measure(lambda: compiled.predict_lemmatized(lemmatized), args.repeat)
+        report(f'{code} compiled, batch', seconds, len(texts))
+        if (output != expected).any():
+            raise AssertionError(f'{code}: compiled predictions differ')
+
+
+def bench_incremental(args):
+    """Re-score a long text after one-sentence edits, from scratch and with the IncrementalScorer"""
+    import random
+    from src import resources
+    from src.compiled import CompiledLinearScorer
+    from src.incremental import IncrementalScorer, sentence_spans
+
+    sentences = [text[start:end].strip() for text in load_texts(args.dataset, args.limit)
+                 for start, end in sentence_spans(text)]
+    sentences = [sentence for sentence in sentences if sentence]
+    rng = random.Random(0)
+    for code in args.classifier:
+        pipe = resources.get_pipeline(code, args.models)
+        compiled = CompiledLinearScorer.from_pipeline(pipe)
+        scorer = IncrementalScorer(pipe, compiled)
+        print(f'{code}: sentences lemmatized with {scorer.context} tokens of context on each side')
+        document = rng.sample(sentences, min(args.sentences, len(sentences)))
+        versions = []
+        for _ in range(args.edits):
+            document[rng.randrange(len(document))] = rng.choice(sentences)
+            versions.append(' '.join(document))
+        scorer.predict(versions[0])
+
+        expected, seconds = measure(lambda: [compiled.predict([text])[0] for text in versions[1:]], repeat=1)
+        report(f'{code} whole text after each edit', seconds, len(versions) - 1, unit='edits')
+        output, seconds = measure(lambda: [scorer.predict(text) for text in versions[1:]], repeat=1)
+        report(f'{code} incremental after each edit', seconds, len(versions) - 1, unit='edits')
+        if scorer.counts != scorer.full_counts(versions[-1]):
+            raise AssertionError(f'{code}: incremental counts differ from the whole-text lemmatization')
+        if output != expected:
+            raise AssertionError(f'{code}: incremental predictions differ from compiled.predict')
+
+
+# Modules that `import app` must not load: they are imported by the features that use them
+LAZY_MODULES = ('spacy', 'sklearn', 'nltk', 'deep_translator', 'src.CustomPortugueseLemmatizer')
+
+
+def bench_importtime(args):
+    """Report the import time of the app (python -X importtime) and fail above --max-ms"""
+    import subprocess
+    import sys
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {args.module}'],
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError(process.stderr.splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package", nested imports indented
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative) / 1000, name.rstrip()))
+    cumulative = {name.strip(): ms for ms, name in imports}
+    # slowest imports, by cumulative time
+    for ms, name in sorted(imports, reverse=True)[:args.top]:
+        print(f'{name.strip():<40s} {ms:10.2f} ms')
+
+    eager = [module for module in LAZY_MODULES if module in cumulative]
+    total = cumulative[args.module]
+    report(f'import {args.module}', total / 1000)
+    if eager:
+        raise AssertionError(f'import {args.module} loads {", ".join(eager)}')
+    if args.max_ms and total > args.max_ms:
+        raise AssertionError(f'import {args.module} takes {total:.0f} ms (> {args.max_ms} ms)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    lemmatizer = subparsers.add_parser('lemmatizer', help=bench_lemmatizer.__doc__)
+    lemmatizer.add_argument('--dataset', default='dataset.csv')
+    lemmatizer.add_argument('--limit', type=int, default=500)
+    lemmatizer.add_argument('--repeat', type=int, default=1)
+    lemmatizer.add_argument('--batch-size', type=int, nargs='+', default=[16, 64, 256])
+    lemmatizer.add_argument('--n-process', type=int, nargs='+', default=[1, 2])
+    lemmatizer.set_defaults(run=bench_lemmatizer)
+
+    profiles = subparsers.add_parser('profiles', help=bench_profiles.__doc__)
+    profiles.add_argument('--dataset', default='dataset.csv')
+    profiles.add_argument('--limit', type=int, default=500)
+    profiles.add_argument('--repeat', type=int, default=1)
+    profiles.set_defaults(run=bench_profiles)
+
+    synonyms = subparsers.add_parser('synonyms', help=bench_synonyms.__doc__)
+    synonyms.add_argument('--dataset', default='dataset.csv')
+    synonyms.add_argument('--limit', type=int, default=100)
+    synonyms.add_argument('--repeat', type=int, default=3)
+    synonyms.add_argument('--index', default='synonyms_por.tsv.gz')
+    synonyms.set_defaults(run=bench_synonyms)
+
+    cleaning = subparsers.add_parser('cleaning', help=bench_cleaning.__doc__)
+    cleaning.add_argument('--dataset', default='dataset.csv')
+    cleaning.add_argument('--limit', type=int, default=200)
+    cleaning.add_argument('--repeat', type=int, default=3)
+    cleaning.set_defaults(run=bench_cleaning)
+
+    cleaning_check = subparsers.add_parser('check-cleaning', help=check_cleaning.__doc__)
+    cleaning_check.add_argument('--texts', type=int, default=20000)
+    cleaning_check.add_argument('--seed', type=int, default=0)
+    cleaning_check.set_defaults(run=check_cleaning)
+
+    cv = subparsers.add_parser('cv', help=bench_cv.__doc__)
+    cv.add_argument('--vocabulary', type=int, default=5000)
+    cv.add_argument('--words', type=int, default=200000)
+    cv.add_argument('--repeat', type=int, default=3)
+    cv.set_defaults(run=bench_cv)
+
+    paraphrase = subparsers.add_parser('paraphrase', help=bench_paraphrase.__doc__)
+    paraphrase.add_argument('--dataset', default='dataset.csv')
+    paraphrase.add_argument('--limit', type=int, default=100)
+    paraphrase.add_argument('--repeat', type=int, default=3)
+    paraphrase.add_argument('--latency-ms', type=float, default=50)
+    paraphrase.add_argument('--workers', type=int, default=8)
+    paraphrase.set_defaults(run=bench_paraphrase)
+
+    compiled = subparsers.add_parser('compiled', help=bench_compiled.__doc__)
+    compiled.add_argument('--dataset', default='dataset.csv')
+    compiled.add_argument('--limit', type=int, default=500)
+    compiled.add_argument('--repeat', type=int, default=3)
+    compiled.add_argument('--models', default='pickle', help='directory of the pipelines')
+    compiled.add_argument('-c', '--classifier', nargs='+', default=['NB', 'SVC'])
+    compiled.set_defaults(run=bench_compiled)
+
+    incremental = subparsers.add_parser('incremental', help=bench_incremental.__doc__)
+    incremental.add_argument('--dataset', default='dataset.csv')
+    incremental.add_argument('--limit', type=int, default=200)
+    incremental.add_argument('--models', default='pickle', help='directory of the pipelines')
+    incremental.add_argument('-c', '--classifier', nargs='+', default=['NB', 'SVC'])
+    incremental.add_argument('--sentences', type=int, default=40, help='sentences of the edited text')
+    incremental.add_argument('--edits', type=int, default=100)
+    incremental.set_defaults(run=bench_incremental)
+
+    importtime = subparsers.add_parser('importtime', help=bench_importtime.__doc__)
+    importtime.add_argument('--module', default='app')
+    importtime.add_argument('--top', type=int, default=15)
+    importtime.add_argument('--max-ms', type=float, help='fail when the import takes longer')
+    importtime.set_defaults(run=bench_importtime)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__': main()
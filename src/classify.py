@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Offline classification of the writing level of whole batches of texts.
+
+The pipelines are loaded once per worker, the texts are streamed from a csv or
+jsonl file (one object per line) and scored in batches, and the predicted levels
+(1 to 4, as in the app) are written with the per-class scores of each classifier.
+Run from the root of the repository, e.g.:
+
+    python -m src.classify exams.csv -o predictions.csv --classifier NB SVC --workers 4
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+
+from src import resources
+from src.scoring import LEVELS, MultiScorer, level_name
+
+CODES = ('NB', 'SVC')
+
+
+def load_scorer(codes=CODES, path='pickle'):
+    """Load the pipelines of the classifiers `codes` behind a single MultiScorer"""
+    return MultiScorer({code: resources.get_pipeline(code, path) for code in codes})
+
+
+def score_texts(scorer, texts, language='Português'):
+    """
+    Score a batch of texts with every classifier of `scorer`.
+
+    return:
+        value: one dict per text with, for each classifier code, the predicted
+               `{code}_level`, its `{code}_level_name` and the `{code}_score_{class}` scores.
+    """
+    texts = list(texts)
+    results = [{} for _ in texts]
+    for code in scorer.pipes:
+        clf = scorer.classifier(code)
+        levels = clf.predict(scorer.tfidf(code, texts))
+        scores = scorer.decision_scores(code, texts)
+        for result, level, row in zip(results, levels, scores):
+            result[f'{code}_level'] = int(level)
+            result[f'{code}_level_name'] = level_name(level, language)
+            for label, score in zip(clf.classes_, row):
+                result[f'{code}_score_{label}'] = round(float(score), 6)
+    return results
+
+
+def read_texts(path, text_column='text', id_column='id'):
+    """Lazily yield (id, text) from a csv file or a jsonl file"""
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = csv.DictReader(file)
+        for number, record in enumerate(records):
+            yield record.get(id_column, number), record[text_column]
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Scorer of each worker process, loaded once by `init_worker`
+_scorer = None
+_language = None
+
+
+def init_worker(codes, path, language):
+    global _scorer, _language
+    _scorer = load_scorer(codes, path)
+    _language = language
+
+
+def score_batch(batch):
+    ids = [id_ for id_, _ in batch]
+    results = score_texts(_scorer, [text for _, text in batch], _language)
+    return [dict(id=id_, **result) for id_, result in zip(ids, results)]
+
+
+def imap_bounded(pool, function, iterable, window):
+    """Ordered pool.imap that keeps at most `window` tasks in flight,
+    so the input is not read ahead of the workers
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class ResultWriter():
+    """Write result dicts to a csv (header from the first row) or a jsonl file"""
+    def __init__(self, file, jsonl=False):
+        self.file = file
+        self.jsonl = jsonl
+        self.writer = None
+
+    def write(self, result):
+        if self.jsonl:
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(result), lineterminator='\n')
+            self.writer.writeheader()
+        self.writer.writerow(result)
+
+
+def score_file(input_path, output_path, codes=CODES, path='pickle', batch_size=256, workers=1,
+               language='Português', text_column='text', id_column='id'):
+    """
+    Score every text of `input_path` and write the results to `output_path` ('-' for stdout).
+
+    return:
+        value: throughput statistics (texts, batches, load and scoring time, texts per second).
+    """
+    start = time.perf_counter()
+    batches = batched(read_texts(input_path, text_column, id_column), batch_size)
+    stats = {'texts': 0, 'batches': 0}
+
+    output = sys.stdout if output_path == '-' else open(output_path, 'w', newline='', encoding='utf-8')
+    writer = ResultWriter(output, jsonl=output_path.endswith('.jsonl'))
+    pool = None
+    try:
+        if workers <= 1:
+            init_worker(codes, path, language)
+            stats['load_time'] = time.perf_counter() - start
+            results = map(score_batch, batches)
+        else:
+            pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(codes, path, language))
+            stats['load_time'] = None
+            results = imap_bounded(pool, score_batch, batches, window=2 * workers)
+        for batch in results:
+            for result in batch:
+                writer.write(result)
+            stats['texts'] += len(batch)
+            stats['batches'] += 1
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if output is not sys.stdout:
+            output.close()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['texts_per_second'] = stats['texts'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='csv or jsonl file with the texts')
+    parser.add_argument('-o', '--output', default='-', help='csv or jsonl file for the results (default: stdout)')
+    parser.add_argument('-c', '--classifier', nargs='+', default=list(CODES), choices=CODES)
+    parser.add_argument('--models', default='pickle', help='directory of the pipelines')
+    parser.add_argument('-b', '--batch-size', type=int, default=256)
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    parser.add_argument('--language', default='Português', choices=list(LEVELS))
+    parser.add_argument('--text-column', default='text')
+    parser.add_argument('--id-column', default='id')
+    args = parser.parse_args()
+
+    stats = score_file(args.input, args.output, args.classifier, args.models, args.batch_size, args.workers,
+                       args.language, args.text_column, args.id_column)
+    print(f'{stats["texts"]} texts in {stats["batches"]} batches, {stats["seconds"]:.2f} s '
+          f'({stats["texts_per_second"]:.1f} texts/s)', file=sys.stderr)
+
+
+if __name__ == '__main__': main()
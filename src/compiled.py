@@ -0,0 +1,167 @@
+"""
+Compiled prediction path for the lemmatizer -> CountVectorizer -> TfidfTransformer
+-> linear classifier pipelines.
+
+The TF-IDF weight of a term is its count times its idf, divided by the L2 norm of
+the document, so the score of a class is
+
+    score_k = sum_j count_j * (idf_j * W_kj) / norm + b_k
+
+The idf is folded into the weights W of the classifier (coef_ of LinearSVC,
+feature_log_prob_ of MultinomialNB) once, and each document is scored with a
+vocabulary lookup of its tokens, a sparse dot product and its norm, without
+the intermediate count and TF-IDF matrices of `pipe.predict`.
+
+The slim model format of `src.model_io` stores the folded weights as well, so
+`get_compiled` memory-maps them and the worker processes share a single copy.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from src.model_io import CLASSIFIER_ARRAYS
+
+# weights and intercept of the supported classifiers, SGDClassifier coming from src.streaming_training
+WEIGHT_ARRAYS = dict(CLASSIFIER_ARRAYS, SGDClassifier=('coef_', 'intercept_'))
+
+
+class CompiledLinearScorer():
+    """
+    Predictions identical to the ones of a fitted pipeline, computed from a
+    single folded weight matrix. Build it with `from_pipeline`.
+
+    arguments:
+        lemmatizer: CustomPortugueseLemmatizer of the pipeline.
+        analyzer: tokenizer of the CountVectorizer, built once.
+        vocabulary: {term: column} of the CountVectorizer, or the HashingVectorizer
+                    (with alternate_sign=False and norm=None) that maps the terms to columns.
+        weights: (n_features, n_classes) weights, multiplied by the idf.
+        intercept: (n_classes,) intercept or class log prior.
+        idf: (n_features,) idf weights, for the document norms.
+        classes: labels of the classifier.
+        norm: 'l2' or None, as in the TfidfTransformer.
+        sublinear_tf, binary: term frequency options of the pipeline.
+    """
+    def __init__(self, lemmatizer, analyzer, vocabulary, weights, intercept, idf, classes, norm='l2',
+                 sublinear_tf=False, binary=False):
+        self.lemmatizer = lemmatizer
+        self.analyzer = analyzer
+        self.vocabulary = vocabulary
+        self.weights = weights
+        self.intercept = intercept
+        self.squared_idf = idf ** 2
+        self.classes = classes
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.binary = binary
+
+    @staticmethod
+    def fold_weights(pipe):
+        """(n_features, n_classes) weights of the classifier of `pipe` multiplied by the idf"""
+        (_, _), (_, _), (_, tfidf), (_, clf) = pipe.steps
+        name = type(clf).__name__
+        if name not in WEIGHT_ARRAYS:
+            raise ValueError(f'Unsupported classifier: {name}')
+        coef = np.asarray(getattr(clf, WEIGHT_ARRAYS[name][0]), dtype=np.float64)
+        idf = np.asarray(tfidf.idf_, dtype=np.float64) if tfidf.use_idf else 1.0
+        # contiguous for the sparse dot product
+        return np.ascontiguousarray((coef * idf).T)
+
+    @classmethod
+    def from_pipeline(cls, pipe, weights=None):
+        """Compile a fitted lemmatizer -> CountVectorizer -> TfidfTransformer -> classifier pipeline.
+        `weights` are the folded weights of the pipeline when they are already available,
+        e.g. memory-mapped from a slim model directory.
+        """
+        (_, lemmatizer), (_, vectorizer), (_, tfidf), (_, clf) = pipe.steps
+        name = type(clf).__name__
+        if name not in WEIGHT_ARRAYS:
+            raise ValueError(f'Unsupported classifier: {name}')
+        if tfidf.norm not in ('l2', None):
+            raise ValueError(f'Unsupported TF-IDF norm: {tfidf.norm}')
+
+        if hasattr(vectorizer, 'vocabulary_'):
+            vocabulary = vectorizer.vocabulary_
+            n_features = len(vocabulary)
+        elif (type(vectorizer).__name__ == 'HashingVectorizer'
+              and not vectorizer.alternate_sign and vectorizer.norm is None):
+            vocabulary = vectorizer
+            n_features = vectorizer.n_features
+        else:
+            raise ValueError(f'Unsupported vectorizer: {vectorizer}')
+        idf = np.asarray(tfidf.idf_, dtype=np.float64) if tfidf.use_idf else np.ones(n_features)
+        if weights is None:
+            weights = cls.fold_weights(pipe)
+        elif weights.shape[0] != n_features:
+            raise ValueError(f'Folded weights for {weights.shape[0]} features, the pipeline has {n_features}')
+        return cls(
+            lemmatizer=lemmatizer,
+            analyzer=vectorizer.build_analyzer(),
+            vocabulary=vocabulary,
+            weights=weights,
+            intercept=np.asarray(getattr(clf, WEIGHT_ARRAYS[name][1]), dtype=np.float64),
+            idf=idf,
+            classes=np.asarray(clf.classes_),
+            norm=tfidf.norm,
+            sublinear_tf=tfidf.sublinear_tf,
+            binary=vectorizer.binary,
+        )
+
+    def raw_counts(self, lemmatized):
+        """Sparse (n_docs, n_features) term counts of lemmatized texts"""
+        vocabulary = self.vocabulary
+        if not isinstance(vocabulary, dict):
+            # stateless hashing of the terms
+            return vocabulary.transform(lemmatized).astype(np.float64)
+        indices = []
+        data = []
+        indptr = [0]
+        for text in lemmatized:
+            counts = {}
+            for term in self.analyzer(text):
+                column = vocabulary.get(term)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            indices.extend(counts)
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        return sp.csr_matrix((np.asarray(data, dtype=np.float64), indices, indptr),
+                             shape=(len(indptr) - 1, len(vocabulary)))
+
+    def _term_frequencies(self, matrix):
+        """Term frequencies of the pipeline (binary, sublinear) from raw counts, in place"""
+        if self.binary:
+            matrix.data[:] = 1
+        if self.sublinear_tf:
+            np.log(matrix.data, matrix.data)
+            matrix.data += 1
+        return matrix
+
+    def decision_function_counts(self, counts):
+        """(n_docs, n_classes) scores from the raw term counts (modified in place):
+        decision function or joint log likelihood
+        """
+        counts = self._term_frequencies(counts)
+        scores = counts @ self.weights
+        if self.norm == 'l2':
+            norms = np.sqrt(counts.multiply(counts) @ self.squared_idf)
+            # empty documents keep a zero vector, as in TfidfTransformer
+            norms[norms == 0] = 1
+            scores /= norms[:, None]
+        return scores + self.intercept
+
+    def decision_function_lemmatized(self, lemmatized):
+        return self.decision_function_counts(self.raw_counts(lemmatized))
+
+    def predict_counts(self, counts):
+        scores = self.decision_function_counts(counts)
+        if scores.shape[1] == 1:
+            # binary LinearSVC: a single decision function for the second class
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+    def predict_lemmatized(self, lemmatized):
+        return self.predict_counts(self.raw_counts(lemmatized))
+
+    def predict(self, texts):
+        """Same predictions as `pipe.predict(texts)`"""
+        return self.predict_lemmatized(self.lemmatizer.transform(texts))
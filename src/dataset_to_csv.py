@@ -2,9 +2,20 @@
 # coding: utf-8
 
 # Code adapted from https://towardsdatascience.com/cleaning-preprocessing-text-data-by-building-nlp-pipeline-853148add68a
+import argparse
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
 import os
-import pandas as pd
-import sys
+import re
+
+# Patterns of the cleaning functions, compiled once
+HTTPS_LINKS = re.compile(r'http\S+')
+COM_LINKS = re.compile(r"\ [A-Za-z]*\.com")
+NON_PRINTABLE = re.compile(r'[^\w\s"\'!@#$%&*()-_+=\[\]{}:;.,|]+')
+WHITESPACE = re.compile(r'\s+')
 
 def remove_newlines_tabs(text):
     """
@@ -63,12 +74,10 @@ def remove_links(text):
     Output : To know more about this website: visit:     
     
     """
-    import re
-
     # Removing all the occurrences of links that starts with https
-    remove_https = re.sub(r'http\S+', '', text)
+    remove_https = HTTPS_LINKS.sub('', text)
     # Remove all the occurrences of text that ends with .com
-    remove_com = re.sub(r"\ [A-Za-z]*\.com", " ", remove_https)
+    remove_com = COM_LINKS.sub(" ", remove_https)
     return remove_com
 
 def remove_whitespace(text):
@@ -85,13 +94,9 @@ def remove_whitespace(text):
     Output : How are you doing ?     
         
     """
-    import re
-
     # Remove leading whitespaces, newline and tab characters
     text = text.lstrip()
-    # Create pattern
-    pattern = re.compile(r'\s+') 
-    Without_whitespace = re.sub(pattern, ' ', text)
+    Without_whitespace = WHITESPACE.sub(' ', text)
     # There are some instances where there is no space after '?' & ')', 
     # So I am replacing these with one space so that It will not consider two words as one token.
     text = Without_whitespace.replace('?', ' ? ').replace(')', ') ')
@@ -111,10 +116,8 @@ def remove_non_printable(text):
     Output : I'm great!
     
     """
-    import re
-
     # Remove non-printable characters, keeping white spaces and punctuation marks
-    text = re.sub('[^\w\s"\'!@#$%&*()-_+=\[\]{}:;.,|]+','', text)
+    text = NON_PRINTABLE.sub('', text)
     return text
 
 # Code for text lowercasing
@@ -139,10 +142,10 @@ def lower_casing_text(text):
     text = text.lower()
     return text
 
-def cleaning(text):
+def cleaning_stages(text):
     """
-    Do some cleaning in the original text, removing line breaks, tabs, 
-    html tags, links, and whitespaces.
+    Apply the cleaning functions one after the other.
+    Reference implementation of `cleaning`.
     """
     string = remove_newlines_tabs(text)
     string = strip_html_tags(string)
@@ -151,6 +154,22 @@ def cleaning(text):
     string = remove_whitespace(string)
     return string
 
+def cleaning(text):
+    """
+    Do some cleaning in the original text, removing line breaks, tabs, 
+    html tags, links, and whitespaces.
+    Same output as `cleaning_stages`, inlined, without the html parser when there is no markup.
+    """
+    # str.replace chains are faster than a single regex or translate pass
+    # for these few literals, since they do not copy strings without matches
+    string = text.replace('\\n', ' ').replace('\n', ' ').replace('\t',' ').replace('\\', ' ').replace('. com', '.com')
+    # the html parser only changes text with tags or character references
+    if '<' in string or '&' in string:
+        string = strip_html_tags(string)
+    string = COM_LINKS.sub(' ', HTTPS_LINKS.sub('', string))
+    string = NON_PRINTABLE.sub('', string)
+    return WHITESPACE.sub(' ', string.lstrip()).replace('?', ' ? ').replace(')', ') ')
+
 def preprocessing(text):
     """
     Pre-process the dataset so that it can be used for NLP.
@@ -161,6 +180,148 @@ def preprocessing(text):
     string = lower_casing_text(text)
     return string
 
+def list_files(dataset_dir):
+    """
+    List the plain text files of a dataset in a single traversal.
+    Each child directory of `dataset_dir` holds the files of one label,
+    given by the first character of the directory name.
+
+    return:
+        value: list of (path, id, label), sorted by directory and file name.
+    """
+    files = []
+    for d in sorted(entry.name for entry in os.scandir(dataset_dir) if entry.is_dir()):
+        for f in sorted(entry.name for entry in os.scandir(f'{dataset_dir}/{d}') if entry.is_file()):
+            files.append((f'{dataset_dir}/{d}/{f}', f.rstrip('.txt'), d[0]))
+    return files
+
+def clean_file(text_file):
+    """
+    Clean and pre-process a whole text file, line by line.
+    """
+    return ''.join(preprocessing(cleaning(line)) for line in text_file)
+
+def process_file(task):
+    """
+    Hash a text file and clean it, unless its content hash is the known one.
+
+    arguments:
+        task: (path, known_hash), known_hash being None for new files.
+
+    return:
+        value: (hash, text), text being None when the content has not changed.
+    """
+    path, known_hash = task
+    with open(path, 'rb') as binary_file:
+        data = binary_file.read()
+    digest = hashlib.sha1(data).hexdigest()
+    if digest == known_hash:
+        return digest, None
+    # same decoding and newline handling as open(path) in text mode
+    return digest, clean_file(io.TextIOWrapper(io.BytesIO(data)))
+
+def process_files(tasks, workers=1, chunk_size=16):
+    """
+    Lazily yield the results of `process_file` for each task, in order,
+    using a pool of `workers` processes if more than one.
+    """
+    if workers <= 1:
+        yield from map(process_file, tasks)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(process_file, tasks, chunk_size)
+
+def manifest_path(output):
+    """
+    Path of the manifest kept next to the csv dataset.
+    """
+    return os.path.splitext(output)[0] + '.manifest.json'
+
+def read_rows(output):
+    """
+    Lazily yield the (id, text, label) rows of a csv dataset.
+    """
+    with open(output, newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader, None)
+        yield from reader
+
+def dataset_rows(files, previous, output, manifest, stats, workers=1, chunk_size=16):
+    """
+    Lazily yield the (id, text, label) rows of the dataset, cleaning only the files
+    that are not in the `previous` manifest with the same size, mtime or content hash.
+    The texts of the other files are read back from the previous `output`, whose rows
+    are in the order of `previous`. The new manifest entries are appended to `manifest`.
+    """
+    known = {entry['path']: entry for entry in previous}
+    file_stats = [os.stat(path) for path, _, _ in files]
+    tasks = []
+    for (path, _, _), file_stat in zip(files, file_stats):
+        entry = known.get(path)
+        if entry is None or entry['size'] != file_stat.st_size or entry['mtime'] != file_stat.st_mtime_ns:
+            tasks.append((path, entry['sha1'] if entry else None))
+    changed = {path for path, _ in tasks}
+    results = process_files(tasks, workers, chunk_size)
+    # files present in both runs keep their relative order, so the previous
+    # rows can be merged in a single pass without loading them in memory
+    previous_rows = zip(previous, read_rows(output)) if previous else iter(())
+
+    for (path, id_, label), file_stat in zip(files, file_stats):
+        if path in changed:
+            digest, text = next(results)
+        else:
+            digest, text = known[path]['sha1'], None
+
+        if text is None:
+            for entry, row in previous_rows:
+                if entry['path'] == path:
+                    text = row[1]
+                    break
+            else:
+                raise ValueError(f'{output} does not match its manifest, rebuild it without --incremental')
+            stats['reused'] += 1
+        else:
+            stats['cleaned'] += 1
+
+        manifest.append({'path': path, 'size': file_stat.st_size, 'mtime': file_stat.st_mtime_ns, 'sha1': digest})
+        yield [id_, text, label]
+
+def write_csv(rows, output):
+    """
+    Write (id, text, label) rows to a csv file as they are produced.
+    """
+    with open(output, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(['id', 'text', 'label'])
+        writer.writerows(rows)
+
+def build_dataset(dataset_dir, output='dataset.csv', workers=1, chunk_size=16, incremental=False):
+    """
+    Generate the csv dataset of `dataset_dir` and its manifest of file path, size,
+    mtime and content hash. In incremental mode, only the files that are new or
+    changed since the previous run are cleaned again.
+
+    return:
+        value: dict with the number of cleaned, reused and removed files.
+    """
+    files = list_files(dataset_dir)
+    previous = []
+    if incremental and os.path.exists(output) and os.path.exists(manifest_path(output)):
+        with open(manifest_path(output), encoding='utf-8') as manifest_file:
+            previous = json.load(manifest_file)['files']
+
+    manifest = []
+    stats = {'cleaned': 0, 'reused': 0}
+    # the previous dataset is read while the new one is written, so write to a temporary file
+    write_csv(dataset_rows(files, previous, output, manifest, stats, workers, chunk_size), output + '.tmp')
+    os.replace(output + '.tmp', output)
+    with open(manifest_path(output) + '.tmp', 'w', encoding='utf-8') as manifest_file:
+        json.dump({'files': manifest}, manifest_file)
+    os.replace(manifest_path(output) + '.tmp', manifest_path(output))
+
+    stats['removed'] = len({entry['path'] for entry in previous} - {entry['path'] for entry in manifest})
+    return stats
+
 def main():
     """
     Walk through child directories of a top directory 
@@ -169,23 +330,29 @@ def main():
 
     arguments:
         dataset_dir: run from the cmd line `python3 dataset_to_csv.py dataset/`
+        --output: path of the csv file (default: dataset.csv)
+        --workers: number of worker processes (default: number of CPUs)
+        --chunk-size: number of files sent to a worker at a time (default: 16)
+        --incremental: only clean the files added or changed since the previous run
+        --parquet: also write a columnar copy with the lemmatized features (see src/feature_store.py),
+                   run from the root of the repository as `python -m src.dataset_to_csv dataset/ --parquet dataset.parquet`
     """
+    parser = argparse.ArgumentParser(description='Generate a clean csv dataset from a directory of plain text files.')
+    parser.add_argument('dataset_dir')
+    parser.add_argument('-o', '--output', default='dataset.csv')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=16)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--parquet')
+    args = parser.parse_args()
 
-    dataset_dir = sys.argv[1]
-    texts = []
-    for root, directories, files in os.walk(dataset_dir):
-        for d in directories:
-            for _, _, files2 in os.walk(f'{dataset_dir}/{d}'):
-                for f in files2:
-                    with open(f'{dataset_dir}/{d}/{f}') as text_file:
-                        text = ''
-                        for line in text_file.readlines():
-                            text_clean = cleaning(line)
-                            text_clean = preprocessing(text_clean)
-                            text += text_clean
-                        texts.append({'id': f.rstrip('.txt'), 'text': text, 'label': d[0]})
-    
-    df = pd.DataFrame(texts)
-    df.to_csv('dataset.csv', index=False)
+    stats = build_dataset(args.dataset_dir, args.output, args.workers, args.chunk_size, args.incremental)
+    print(f'{args.output}: {stats["cleaned"]} files cleaned, {stats["reused"]} reused, {stats["removed"]} removed')
+
+    if args.parquet:
+        from src.feature_store import write_features
+
+        write_features(args.output, args.parquet)
+        print(f'{args.parquet}: lemmatized features written')
 
 if __name__ == '__main__': main()
\ No newline at end of file
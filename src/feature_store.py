@@ -0,0 +1,110 @@
+"""
+Columnar (Parquet) copy of the csv dataset with the output of the lemmatizer.
+
+Besides the `id`, `text` and `label` columns of `dataset.csv`, the file stores
+the lemmas (`words`) and the CV features (`cv`) of each text, so training and
+evaluation runs can memory-map the lemmatized features instead of running
+spaCy again. The file records the spaCy model version it was built with, and
+`load_features` lemmatizes the texts again when that version changes.
+
+Requires pyarrow (`pip install pyarrow`). Build it with:
+
+    python -m src.dataset_to_csv dataset/ --parquet dataset.parquet
+
+and train the steps after the lemmatizer on the `features` column, e.g.
+`pipe[1:].fit(df['features'], df['label'])`.
+"""
+import os
+
+FEATURES_KEY = b'lemmatizer_version'
+
+
+def lemmatizer_version(lemmatizer):
+    """Identifies the lemmatizer output: the spaCy and model versions and the phonotactic features"""
+    import spacy
+    from spacy.util import get_package_version
+
+    return (f'{lemmatizer.spacy_model}=={get_package_version(lemmatizer.spacy_model)};spacy=={spacy.__version__};'
+            f'features={",".join(lemmatizer.phonotactic_features)}')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Columnar datasets require pyarrow: pip install pyarrow') from None
+    return pyarrow, pyarrow.parquet
+
+
+def _feature_batches(frames, lemmatizer, version):
+    """Yield pyarrow record batches of the data frames with their lemmatized columns"""
+    pa, _ = _import_pyarrow()
+    for df in frames:
+        features = list(lemmatizer.pipe_features(df['text'].tolist()))
+        df = df.assign(words=[' '.join(word_list) for word_list, _ in features],
+                       cv=[' '.join(cv_list) for _, cv_list in features])
+        batch = pa.RecordBatch.from_pandas(df[['id', 'text', 'label', 'words', 'cv']], preserve_index=False)
+        yield batch.replace_schema_metadata({FEATURES_KEY: version.encode('utf-8')})
+
+
+def _write_batches(batches, path):
+    """Write record batches to `path` one row group at a time"""
+    pa, pq = _import_pyarrow()
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(path + '.tmp', batch.schema)
+            writer.write_table(pa.Table.from_batches([batch]))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(path + '.tmp', path)
+
+
+def write_features(csv_path, path, lemmatizer=None, chunk_size=1000):
+    """
+    Write the csv dataset `csv_path` and its lemmatized features to the Parquet file `path`,
+    reading and lemmatizing `chunk_size` rows at a time.
+    """
+    import pandas as pd
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+    lemmatizer = lemmatizer or CustomPortugueseLemmatizer()
+    # all columns as strings, so every chunk has the same schema
+    frames = pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    _write_batches(_feature_batches(frames, lemmatizer, lemmatizer_version(lemmatizer)), path)
+
+
+def load_features(path, lemmatizer=None, chunk_size=1000):
+    """
+    Read a columnar dataset written by `write_features`, memory-mapped, as a DataFrame
+    indexed by `id` with the `text`, `label` and `features` columns, `features` being
+    the output of CustomPortugueseLemmatizer.transform for each text.
+    The file is lemmatized again first if the spaCy model version has changed.
+    """
+    import pandas as pd
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+    _, pq = _import_pyarrow()
+    # the version only needs the model name, so spaCy is not loaded when the file is up to date
+    version = lemmatizer_version(lemmatizer or CustomPortugueseLemmatizer)
+
+    metadata = pq.read_schema(path).metadata or {}
+    if metadata.get(FEATURES_KEY, b'').decode('utf-8') != version:
+        lemmatizer = lemmatizer or CustomPortugueseLemmatizer()
+        table = pq.read_table(path, columns=['id', 'text', 'label'], memory_map=True)
+        frames = (batch.to_pandas() for batch in table.to_batches(max_chunksize=chunk_size))
+        _write_batches(_feature_batches(frames, lemmatizer, version), path)
+
+    df = pq.read_table(path, memory_map=True).to_pandas()
+    df['features'] = df['words'] + ' ' + df['cv']
+    # same column types as pd.read_csv of the csv dataset
+    for column in ('id', 'label'):
+        try:
+            df[column] = pd.to_numeric(df[column])
+        except ValueError:
+            pass
+    return df.drop(columns=['words', 'cv']).set_index('id')
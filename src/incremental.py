@@ -0,0 +1,183 @@
+"""
+Incremental re-scoring of a text that is edited a little at a time.
+
+With unigram counts, the count vector of a lemmatized text is the sum of the
+count vectors of its tokens, so it is also the sum of the count vectors of its
+sentences. The scorer splits the text into sentences, keeps the term counts of
+each sentence in a cache, and updates the running count vector of the document
+by subtracting the sentences removed by an edit and adding the new ones, before
+TF-IDF and the classifier. Only the edited sentences go through spaCy, so the
+latency follows the size of the edit rather than the size of the text.
+
+The spaCy tagger looks at the tokens around each token, so a sentence is not
+lemmatized on its own: it is lemmatized together with as many words of the
+neighbouring sentences on each side (or up to the ends of the text) as the
+loaded spaCy pipeline can look at (see `context_tokens`), and only the tokens
+that start inside the sentence are counted. A sentence is cached with its
+context, so editing a sentence also re-scores the neighbours that had it in
+their context, and the counts are those of the whole text lemmatized at once
+(see `full_counts`).
+"""
+import re
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.scoring import LRUCache
+
+# Sentence boundaries: whitespace after final punctuation, or line breaks.
+# Tokens never span whitespace, so the split does not change the tokenization.
+SENTENCES = re.compile(r'(?<=[.!?…])\s+|\s*\n\s*')
+
+# Factories of the components whose output for a token only depends on that token
+# and the previous components, without a model of their own
+TOKEN_FACTORIES = ('lemmatizer', 'sentencizer')
+
+
+def _encoder_context(config):
+    """Tokens on each side seen by the encoders in the config of a model: depth * window_size
+    for each CNN encoder (MaxoutWindowEncoder, MishWindowEncoder, HashEmbedCNN)
+    """
+    if isinstance(config, dict):
+        architecture = str(config.get('@architectures', ''))
+        if 'bilstm' in architecture.lower() or 'transformer' in architecture.lower():
+            raise ValueError(f'{architecture} sees the whole text, incremental scoring needs a CNN encoder')
+        context = config['depth'] * config['window_size'] if 'depth' in config and 'window_size' in config else 0
+        return context + sum(_encoder_context(value) for value in config.values())
+    if isinstance(config, (list, tuple)):
+        return sum(_encoder_context(value) for value in config)
+    return 0
+
+
+def context_tokens(nlp):
+    """
+    Number of tokens on each side of a token that can change its lemma, POS or
+    stop word flag in the spaCy pipeline `nlp`: the widest receptive field of the
+    encoders of its components, plus the span of the attribute ruler patterns.
+    Raise ValueError for components whose context cannot be told from their config.
+    """
+    encoders = 0
+    patterns = 0
+    for name in nlp.pipe_names:
+        config = nlp.config['components'][name]
+        if config.get('model') is not None:
+            encoders = max(encoders, _encoder_context(config['model']))
+        elif config.get('factory') == 'attribute_ruler':
+            for pattern in nlp.get_pipe(name).patterns:
+                patterns = max([patterns] + [len(tokens) - 1 for tokens in pattern['patterns']])
+        elif config.get('factory') not in TOKEN_FACTORIES:
+            raise ValueError(f'Cannot tell the context of the spaCy component {name!r}')
+    return encoders + patterns
+
+
+def sentence_spans(text):
+    """(start, end) of the sentences of `text`, each with the whitespace that follows it,
+    so the spans cover the whole text
+    """
+    starts = [0] + [match.end() for match in SENTENCES.finditer(text)]
+    ends = starts[1:] + [len(text)]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+
+def sentence_contexts(text, context_words):
+    """(context, start, end) of each sentence of `text`: the sentence with at least
+    `context_words` words of its neighbouring sentences on each side (each word
+    is at least one token), and the position of the sentence in it
+    """
+    spans = sentence_spans(text)
+    words = [len(text[start:end].split()) for start, end in spans]
+    contexts = []
+    for i, (start, end) in enumerate(spans):
+        first, before = i, 0
+        while first > 0 and before < context_words:
+            first -= 1
+            before += words[first]
+        last, after = i, 0
+        while last < len(spans) - 1 and after < context_words:
+            last += 1
+            after += words[last]
+        offset = spans[first][0]
+        contexts.append((text[offset:spans[last][1]], start - offset, end - offset))
+    return contexts
+
+
+class IncrementalScorer():
+    """
+    Score successive versions of a text, re-processing only the sentences that changed.
+
+    arguments:
+        pipe: fitted lemmatizer -> vectorizer -> TF-IDF -> classifier pipeline,
+              with a word analyzer and unigrams only.
+        compiled: CompiledLinearScorer of the pipeline (built from `pipe` by default).
+        maxsize: number of sentence count vectors kept in cache.
+        context: tokens of context on each side of a token that spaCy needs
+                 (`context_tokens` of the spaCy pipeline of the lemmatizer by default).
+    """
+    def __init__(self, pipe, compiled=None, maxsize=10000, context=None):
+        from src.compiled import CompiledLinearScorer
+
+        vectorizer = pipe.steps[1][1]
+        if vectorizer.analyzer != 'word' or tuple(vectorizer.ngram_range) != (1, 1):
+            raise ValueError('Incremental scoring needs a word analyzer with ngram_range=(1, 1)')
+        self.compiled = compiled or CompiledLinearScorer.from_pipeline(pipe)
+        self.context = context_tokens(self.compiled.lemmatizer.spacy_nlp) if context is None else context
+        self.sentence_counts = LRUCache(maxsize)
+        # sentences (with their contexts) of the last scored text and the sum of their counts
+        self.sentences = Counter()
+        self.counts = Counter()
+
+    def _lemmatize(self, contexts):
+        """Lemmatized text of the tokens of each sentence, lemmatized within its context"""
+        lemmatizer = self.compiled.lemmatizer
+        docs = lemmatizer.spacy_nlp.pipe([context for context, _, _ in contexts], batch_size=lemmatizer.batch_size)
+        lemmatized = []
+        for (_, start, end), doc in zip(contexts, docs):
+            tokens = [token for token in doc if start <= token.idx < end]
+            lemmatized.append(lemmatizer.join_features(*lemmatizer.features(tokens)))
+        return lemmatized
+
+    def _counts(self, contexts):
+        """Term counts {column: count} of each sentence, lemmatizing only the uncached ones"""
+        # kept here rather than read back from the cache, which may evict them within a large edit
+        counts = {}
+        missing = []
+        for context in set(contexts):
+            counts[context] = self.sentence_counts.get(context)
+            if counts[context] is None:
+                missing.append(context)
+        if missing:
+            matrix = self.compiled.raw_counts(self._lemmatize(missing))
+            for context, row in zip(missing, matrix):
+                counts[context] = dict(zip(row.indices.tolist(), row.data.astype(int).tolist()))
+                self.sentence_counts[context] = counts[context]
+        return counts
+
+    def update(self, text):
+        """Update the running counts from the last scored text to `text`"""
+        sentences = Counter(sentence_contexts(text, self.context))
+        removed = self.sentences - sentences
+        added = sentences - self.sentences
+        counts = self._counts(list(removed) + list(added))
+        for changes, sign in ((removed, -1), (added, 1)):
+            for sentence, times in changes.items():
+                for column, count in counts[sentence].items():
+                    self.counts[column] += sign * times * count
+        # drop the terms that are no longer in the text
+        self.counts = +self.counts
+        self.sentences = sentences
+        return self.counts
+
+    def _matrix(self, counts):
+        columns = list(counts)
+        return sp.csr_matrix(([float(counts[column]) for column in columns], columns, [0, len(columns)]),
+                             shape=(1, self.compiled.weights.shape[0]))
+
+    def predict(self, text):
+        """Predicted level of `text`, reusing the sentences of the previously scored text"""
+        return self.compiled.predict_counts(self._matrix(self.update(text)))[0]
+
+    def full_counts(self, text):
+        """Counts of `text` lemmatized at once without the caches, the reference of `update`"""
+        total = np.asarray(self.compiled.raw_counts(self.compiled.lemmatizer.transform([text])).sum(axis=0)).ravel()
+        return Counter({int(column): int(total[column]) for column in total.nonzero()[0]})
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Slim, versioned storage of the fitted classification pipelines.
+
+Instead of pickling the whole sklearn Pipeline (and the spaCy model inside the
+lemmatizer), only the fitted state is written to a directory:
+
+    meta.json           format version, lemmatizer options, step parameters and classes
+    vocabulary.txt      CountVectorizer terms, one per line, in column order
+    idf.npy             TfidfTransformer idf weights
+    <classifier>.npy    classifier coefficients (coef_/intercept_ for LinearSVC,
+                        feature_log_prob_/class_log_prior_ for MultinomialNB)
+    weights.npy         (n_features, n_classes) coefficients multiplied by the idf,
+                        the weights of `src.compiled.CompiledLinearScorer`
+
+The arrays are memory-mapped on load (`load_pipeline`, `load_weights`), so several
+workers share a single copy, and the spaCy model is attached by name from the
+process-wide cache.
+
+Convert an existing pickle with:
+
+    python -m src.model_io pickle/pipeline_NB.pickle pickle/pipeline_NB
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+# 2: lemmatizer options (spaCy model and phonotactic features) in meta.json
+FORMAT_VERSION = 2
+
+# CountVectorizer parameters left out of meta.json: the callables are rejected on export
+# and the fitted vocabulary is written to vocabulary.txt
+VECTORIZER_EXCLUDED = ('preprocessor', 'tokenizer', 'vocabulary')
+TFIDF_PARAMS = ('norm', 'use_idf', 'smooth_idf', 'sublinear_tf')
+CLASSIFIER_ARRAYS = {
+    'MultinomialNB': ('feature_log_prob_', 'class_log_prior_'),
+    'LinearSVC': ('coef_', 'intercept_'),
+}
+
+
+def vectorizer_params(vectorizer):
+    """JSON-serializable parameters of a CountVectorizer, all of them but VECTORIZER_EXCLUDED"""
+    params = {param: value for param, value in vectorizer.get_params().items() if param not in VECTORIZER_EXCLUDED}
+    params['dtype'] = np.dtype(params['dtype']).name
+    return params
+
+
+def export_pipeline(pipe, path):
+    """Write the fitted state of a lemmatizer -> CountVectorizer -> TfidfTransformer -> classifier
+    pipeline to the directory `path`
+    """
+    (_, lemmatizer), (_, vectorizer), (_, tfidf), (_, clf) = pipe.steps
+    name = type(clf).__name__
+    if name not in CLASSIFIER_ARRAYS:
+        raise ValueError(f'Unsupported classifier: {name}')
+    if vectorizer.tokenizer is not None or vectorizer.preprocessor is not None or callable(vectorizer.analyzer):
+        raise ValueError('Vectorizers with custom callables cannot be exported')
+
+    import sklearn
+
+    os.makedirs(path, exist_ok=True)
+    terms = vectorizer.get_feature_names_out()
+    with open(f'{path}/vocabulary.txt', 'w', encoding='utf-8') as file:
+        file.write('\n'.join(terms))
+    np.save(f'{path}/idf.npy', tfidf.idf_)
+    for attribute in CLASSIFIER_ARRAYS[name]:
+        np.save(f'{path}/{attribute.rstrip("_")}.npy', getattr(clf, attribute))
+    from src.compiled import CompiledLinearScorer
+    np.save(f'{path}/weights.npy', CompiledLinearScorer.fold_weights(pipe))
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'sklearn_version': sklearn.__version__,
+        'lemmatizer': {
+            'spacy_model': lemmatizer.spacy_model,
+            'phonotactic_features': list(lemmatizer.phonotactic_features),
+        },
+        'step_names': [step_name for step_name, _ in pipe.steps],
+        'vectorizer': vectorizer_params(vectorizer),
+        'tfidf': {param: getattr(tfidf, param) for param in TFIDF_PARAMS},
+        'classifier': name,
+        'classes': clf.classes_.tolist(),
+    }
+    # written last, so an interrupted export is never picked up as a valid model
+    with open(f'{path}/meta.json', 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=1)
+
+
+def version(path):
+    """Modification time of a model directory, used to invalidate cached copies"""
+    return os.path.getmtime(f'{path}/meta.json')
+
+
+def load_pipeline(path, mmap_mode='r'):
+    """Rebuild a fitted sklearn Pipeline from a model directory written by `export_pipeline`"""
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.svm import LinearSVC
+    from sklearn.pipeline import Pipeline
+    from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+    with open(f'{path}/meta.json', encoding='utf-8') as file:
+        meta = json.load(file)
+    if meta['format_version'] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported model format version {meta["format_version"]} in {path}, '
+                         'export it again from the pickle')
+
+    lemmatizer = CustomPortugueseLemmatizer(phonotactic_features=meta['lemmatizer']['phonotactic_features'])
+    if meta['lemmatizer']['spacy_model'] != lemmatizer.spacy_model:
+        lemmatizer.spacy_model = meta['lemmatizer']['spacy_model']
+        lemmatizer.spacy_nlp = lemmatizer.load_spacy()
+
+    params = dict(meta['vectorizer'], ngram_range=tuple(meta['vectorizer']['ngram_range']))
+    if 'dtype' in params:
+        params['dtype'] = np.dtype(params['dtype']).type
+    vectorizer = CountVectorizer(**params)
+    with open(f'{path}/vocabulary.txt', encoding='utf-8') as file:
+        vectorizer.vocabulary_ = {term: column for column, term in enumerate(file.read().split('\n'))}
+    vectorizer.fixed_vocabulary_ = False
+    n_features = len(vectorizer.vocabulary_)
+
+    tfidf = TfidfTransformer(**meta['tfidf'])
+    tfidf.idf_ = np.load(f'{path}/idf.npy', mmap_mode=mmap_mode)
+    tfidf.n_features_in_ = n_features
+
+    clf = MultinomialNB() if meta['classifier'] == 'MultinomialNB' else LinearSVC()
+    for attribute in CLASSIFIER_ARRAYS[meta['classifier']]:
+        setattr(clf, attribute, np.load(f'{path}/{attribute.rstrip("_")}.npy', mmap_mode=mmap_mode))
+    clf.classes_ = np.array(meta['classes'])
+    clf.n_features_in_ = n_features
+
+    steps = [lemmatizer, vectorizer, tfidf, clf]
+    return Pipeline(list(zip(meta['step_names'], steps)))
+
+
+def load_weights(path, mmap_mode='r'):
+    """Folded weights of the compiled scorer in a model directory, None if it has none"""
+    if not os.path.exists(f'{path}/weights.npy'):
+        return None
+    return np.load(f'{path}/weights.npy', mmap_mode=mmap_mode)
+
+
+def main():
+    """
+    Convert a pickled pipeline to the slim model format.
+
+    arguments:
+        run from the cmd line `python -m src.model_io pickle/pipeline_NB.pickle pickle/pipeline_NB`
+    """
+    from src.resources import load_pickle
+
+    source, destination = sys.argv[1], sys.argv[2]
+    with open(source, 'rb') as file:
+        # the pipelines of the notebook refer to __main__.CustomPortugueseLemmatizer
+        pipe = load_pickle(file)
+    export_pipeline(pipe, destination)
+
+    size = sum(entry.stat().st_size for entry in os.scandir(destination))
+    print(f'{source} ({os.path.getsize(source) / 2**20:.2f} MiB) -> {destination} ({size / 2**20:.2f} MiB)')
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,182 @@
+"""Text operations used to probe the robustness of the classifiers:
+word swap (synonym replacement) and gender swap
+"""
+import random
+import re
+
+from src import synonyms
+
+# Pronouns and determiners exchanged by the gender swap
+GENDER_MAP = {
+    'ele': 'ela',
+    'ela': 'ele',
+    'eles': 'elas',
+    'elas': 'eles',
+    'meu': 'minha',
+    'minha': 'meu',
+    'meus': 'minhas',
+    'minhas': 'meus',
+    'teu': 'tua',
+    'tua': 'teu',
+    'teus': 'tuas',
+    'tuas': 'teus',
+    'seu': 'sua',
+    'sua': 'seu',
+    'seus': 'suas',
+    'suas': 'seus',
+    'este': 'esta',
+    'esta': 'este',
+    'estes': 'estas',
+    'estas': 'estes',
+    'esse': 'essa',
+    'essa': 'esse',
+    'esses': 'essas',
+    'essas': 'esses',
+    'aquele': 'aquela',
+    'aquela': 'aquele',
+    'aqueles': 'aquelas',
+    'aquelas': 'aqueles',
+    'àquele': 'àquela',
+    'àquela': 'àquele',
+    'àqueles': 'àquelas',
+    'àquelas': 'àqueles',
+    'mesmo': 'mesma',
+    'mesma': 'mesmo',
+    'mesmos': 'mesmas',
+    'mesmas': 'mesmos',
+    'próprio': 'própria',
+    'própria': 'próprio',
+    'próprios': 'próprias',
+    'próprias': 'próprios',
+    'todo': 'toda',
+    'toda': 'todo',
+    'todos': 'todas',
+    'todas': 'todos',
+    'algum': 'alguma',
+    'alguma': 'algum',
+    'alguns': 'algumas',
+    'algumas': 'alguns',
+    'um': 'uma',
+    'uma': 'um',
+    'uns': 'umas',
+    'umas': 'uns',
+    'certo': 'certa',
+    'certa': 'certo',
+    'certos': 'certas',
+    'certas': 'certos',
+    'vários': 'várias',
+    'várias': 'vários',
+    'muito': 'muita',
+    'muita': 'muito',
+    'muitos': 'muitas',
+    'muitas': 'muitos',
+    'quanto': 'quanta',
+    'quanta': 'quanto',
+    'quantos': 'quantas',
+    'quantas': 'quantos',
+    'tanto': 'tanta',
+    'tanta': 'tanto',
+    'tantos': 'tantas',
+    'tantas': 'tantos',
+    'outro': 'outra',
+    'outra': 'outro',
+    'outros': 'outras',
+    'outras': 'outros',
+}
+
+
+def _case_variants(mapping):
+    """Add the capitalized and upper case forms of every entry of a lowercase mapping"""
+    table = {}
+    for word, swapped in mapping.items():
+        table[word] = swapped
+        table[word.capitalize()] = swapped.capitalize()
+        table[word.upper()] = swapped.upper()
+    return table
+
+
+GENDER_TABLE = _case_variants(GENDER_MAP)
+WORDS = re.compile(r'\w+')
+
+
+def synonym_replacement(words, stop_words, n, rng=random, get_synonyms=synonyms.get_synonyms, stable=False):
+    """
+    Replace up to `n` distinct non stop words of a text by one of their synonyms,
+    in a single pass over the text.
+
+    arguments:
+        words: text of type "String".
+        stop_words: words that are never replaced.
+        n: maximum number of distinct words to replace.
+        rng: source of randomness, the `random` module or a `random.Random` instance.
+             The sequence of random calls is the same as the one of the original
+             implementation, so the same seed gives the same result.
+        stable: shuffle the candidate words in their order of first occurrence
+                instead of the set order of the original implementation, which
+                depends on PYTHONHASHSEED, so a seed gives the same result in every process.
+
+    return:
+        value: text with the words replaced, joined by single spaces.
+    """
+    if n <= 0: # no word to replace, return the original text
+        return words
+
+    words = words.split()
+
+    candidates = [word for word in words if word not in stop_words]
+    random_word_list = list(dict.fromkeys(candidates)) if stable else list(set(candidates))
+    rng.shuffle(random_word_list)
+    num_replaced = 0
+
+    # distinct words of the text, grouped by the string currently shown in their
+    # place: a synonym inserted earlier may itself be replaced by a later word
+    shown = {word: [word] for word in set(words)}
+    replacement = {}
+
+    for random_word in random_word_list:
+        synonyms = get_synonyms(random_word)
+
+        if len(synonyms) >= 1:
+            synonym = rng.choice(list(synonyms))
+            moved = shown.pop(random_word, [])
+            for word in moved:
+                replacement[word] = synonym
+            shown.setdefault(synonym, []).extend(moved)
+            num_replaced += 1
+
+        if num_replaced >= n: #only replace up to n words
+            break
+
+    sentence = ' '.join([replacement.get(word, word) for word in words])
+
+    return sentence
+
+
+def synonym_replacement_batch(texts, stop_words, percent, seed=None):
+    """
+    Apply `synonym_replacement` to many texts, replacing `percent` of the words of
+    each one. The synonym lookups are shared by all the texts through the synonym cache.
+    The results only depend on the seed, whatever the PYTHONHASHSEED of the process.
+    """
+    rng = random.Random(seed)
+    return [synonym_replacement(text, stop_words, len(text.split()) * percent, rng, stable=True) for text in texts]
+
+
+def _swap_word(match):
+    word = match.group()
+    return GENDER_TABLE.get(word, word)
+
+
+def swap_gender(text):
+    """
+    Swap the gender of the pronouns and determiners of a text (e.g. ele -> ela, Minha -> Meu),
+    keeping their case and the original whitespace and punctuation.
+    """
+    return WORDS.sub(_swap_word, text)
+
+
+def swap_gender_batch(texts):
+    """
+    Apply `swap_gender` to many texts.
+    """
+    return [WORDS.sub(_swap_word, text) for text in texts]
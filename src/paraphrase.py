@@ -0,0 +1,158 @@
+"""
+Paraphrase by back-translation (Portuguese -> pivot language -> Portuguese).
+
+Translations go through a pluggable backend and are kept in a disk-backed cache
+keyed by a hash of the text and the language pair, so a text is never sent
+twice to the translation service. Batches of texts are translated concurrently,
+with a bounded number of requests in flight.
+
+Backends:
+    google: Google Translate through deep_translator (network).
+    local:  deterministic offline stand-in that returns the text unchanged,
+            optionally after a simulated latency, for tests and benchmarks.
+"""
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from src.profiling import stage
+
+CACHE_PATH = 'paraphrase_cache.sqlite3'
+
+
+class TranslationBackend():
+    """Interface of the translation backends"""
+    name = None
+    # longest text the backend accepts, None for no limit
+    max_chars = None
+
+    def translate(self, text, source, target):
+        raise NotImplementedError
+
+
+class GoogleBackend(TranslationBackend):
+    name = 'google'
+    max_chars = 5000
+
+    def translate(self, text, source, target):
+        from deep_translator import GoogleTranslator
+
+        return GoogleTranslator(source=source, target=target).translate(text)
+
+
+class LocalBackend(TranslationBackend):
+    """Offline stand-in: returns the text unchanged after `latency_ms` milliseconds"""
+    name = 'local'
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+
+    def translate(self, text, source, target):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return text
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleBackend, LocalBackend)}
+
+
+class TranslationCache():
+    """Translations stored in a SQLite file, shared by the threads of the process"""
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, text TEXT)')
+
+    @staticmethod
+    def key(backend, text, source, target):
+        return hashlib.sha256(f'{backend}\0{source}\0{target}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: translation} for the keys found in the cache"""
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            # bounded number of SQL variables per query
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                query = f'SELECT key, text FROM translations WHERE key IN ({",".join("?" * len(chunk))})'
+                found.update(self._connection.execute(query, chunk).fetchall())
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO translations VALUES (?, ?)', items)
+
+
+class Paraphraser():
+    """
+    Back-translation through a backend, with a persistent cache.
+
+    arguments:
+        backend: TranslationBackend instance.
+        cache_path: SQLite file of the cache, None to disable it.
+        source: language of the texts.
+        pivot: intermediate language.
+        max_workers: maximum number of concurrent translation requests.
+    """
+    def __init__(self, backend=None, cache_path=CACHE_PATH, source='pt', pivot='en', max_workers=4):
+        self.backend = backend or GoogleBackend()
+        self.cache = TranslationCache(cache_path) if cache_path else None
+        self.source = source
+        self.pivot = pivot
+        self.max_workers = max_workers
+
+    def _translate_one(self, text, source, target):
+        if self.backend.max_chars is not None and len(text) >= self.backend.max_chars:
+            return None
+        with stage('paraphrase.translate'):
+            return self.backend.translate(text, source, target)
+
+    def translate_batch(self, texts, source, target):
+        """
+        Translate many texts, calling the backend once per distinct text missing from the cache.
+        Texts that the backend cannot translate (too long) are returned as None.
+        """
+        texts = list(texts)
+        keys = [TranslationCache.key(self.backend.name, text, source, target) for text in texts]
+        translations = self.cache.get_many(set(keys)) if self.cache else {}
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in translations:
+                missing[key] = text
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(lambda text: self._translate_one(text, source, target),
+                                            missing.values()))
+            new = {key: result for key, result in zip(missing, results) if result is not None}
+            if self.cache:
+                self.cache.put_many(new.items())
+            translations.update(new)
+        return [translations.get(key) for key in keys]
+
+    def paraphrase_batch(self, texts):
+        """Return (translated, back_translated) for each text, (None, None) if it cannot be translated"""
+        translated = self.translate_batch(texts, self.source, self.pivot)
+        back = self.translate_batch([text for text in translated if text is not None], self.pivot, self.source)
+        back = iter(back)
+        return [(text, next(back)) if text is not None else (None, None) for text in translated]
+
+    def paraphrase(self, text):
+        """Return the text translated to the pivot language and back"""
+        return self.paraphrase_batch([text])[0]
+
+
+def get_paraphraser(backend=None, cache_path=CACHE_PATH):
+    """Paraphraser shared by the whole process. The backend defaults to
+    the PARAPHRASE_BACKEND environment variable, or 'google'
+    """
+    from src.resources import CACHE
+
+    backend = backend or os.environ.get('PARAPHRASE_BACKEND', 'google')
+    return CACHE.get(('paraphraser', backend, cache_path), lambda: Paraphraser(BACKENDS[backend](), cache_path))
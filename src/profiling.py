@@ -0,0 +1,222 @@
+"""
+Lightweight timing of the hot paths of the app and the lemmatizer.
+
+Stages are timed with a context manager or a decorator:
+
+    from src.profiling import stage, timed
+
+    with stage('spacy.load'):
+        ...
+
+    @timed('synonyms.get_synonyms')
+    def get_synonyms(word): ...
+
+The process-wide PROFILER keeps, for each stage, its number of calls, total time,
+latency percentiles over the most recent calls and, when memory tracing is on,
+the peak memory allocated during the stage (tracemalloc, on inside the
+`memory_tracing()` blocks). `snapshot()` returns
+the statistics as a dict and `dump(path)` writes them as JSON. `profile_call`
+runs a single call under cProfile.
+"""
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+
+class StageStats():
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+        self.peak_bytes = None
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+    def to_dict(self):
+        stats = {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+        }
+        if self.peak_bytes is not None:
+            stats['peak_kib'] = self.peak_bytes / 1024
+        return stats
+
+
+class _Stage():
+    """Context manager timing one execution of a stage"""
+    __slots__ = ('profiler', 'name', 'start', 'memory')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.memory = self.profiler._enter_memory() if tracemalloc.is_tracing() else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        peak = self.profiler._exit_memory(self.memory) if self.memory is not None else None
+        self.profiler.record(self.name, seconds, peak)
+        return False
+
+
+class Profiler():
+    """
+    Per-stage call counts, latencies and allocation peaks.
+
+    arguments:
+        window: number of recent calls of each stage used for the percentiles.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self.enabled = True
+        self._stats = {}
+        self._lock = threading.Lock()
+        # number of `memory_tracing` blocks running
+        self._tracing = 0
+        # stack of [traced memory at entry, highest peak seen] of the running stages
+        self._local = threading.local()
+
+    def stage(self, name):
+        """Context manager timing the code of its block as the stage `name`"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def timed(self, name=None):
+        """Decorator timing every call of a function, as the stage `name` (default: its qualified name)"""
+        def decorator(function):
+            stage_name = name or f'{function.__module__}.{function.__qualname__}'
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Stage(self, stage_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds, peak_bytes=None):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = StageStats(self.window)
+            stats.count += 1
+            stats.total += seconds
+            stats.recent.append(seconds)
+            if peak_bytes is not None:
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak_bytes)
+
+    # tracemalloc only keeps a single peak, so nested stages save the peak of their
+    # parent before resetting it and report their own peak to the parent on exit
+    def _enter_memory(self):
+        stack = self._local.__dict__.setdefault('stack', [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        # reset_peak is Python 3.9+; before, peaks are measured since the start of the tracing
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        entry = [current, current]
+        stack.append(entry)
+        return entry
+
+    def _exit_memory(self, entry):
+        stack = self._local.stack
+        peak = max(entry[1], tracemalloc.get_traced_memory()[1])
+        if stack and stack[-1] is entry:
+            stack.pop()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        return peak - entry[0]
+
+    @staticmethod
+    def start_memory_tracing():
+        """Also record the allocation peaks of the stages (slows down the traced code)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @staticmethod
+    def stop_memory_tracing():
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def memory_tracing(self):
+        """Trace memory while the block runs. Concurrent blocks (e.g. the runs of several
+        sessions of the app) share the tracing, which stops when the last one exits.
+        """
+        with self._lock:
+            self._tracing += 1
+            self.start_memory_tracing()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._tracing -= 1
+                if not self._tracing:
+                    self.stop_memory_tracing()
+
+    def snapshot(self):
+        """{stage: statistics} of every stage recorded so far"""
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in sorted(self._stats.items())}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, indent=1)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class _NullStage():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+# Shared by everything running in this process
+PROFILER = Profiler()
+stage = PROFILER.stage
+timed = PROFILER.timed
+snapshot = PROFILER.snapshot
+dump = PROFILER.dump
+
+
+def profile_call(function, *args, sort='cumulative', limit=30, **kwargs):
+    """
+    Run `function(*args, **kwargs)` under cProfile.
+
+    return:
+        value: the result of the call and the `limit` most expensive functions,
+               sorted by `sort`, as text.
+    """
+    profile = cProfile.Profile()
+    result = profile.runcall(function, *args, **kwargs)
+    output = io.StringIO()
+    pstats.Stats(profile, stream=output).sort_stats(sort).print_stats(limit)
+    return result, output.getvalue()
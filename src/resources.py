@@ -0,0 +1,194 @@
+"""Process-wide cache for the heavy resources used by the app and notebooks:
+the spaCy model, the pickled classification pipelines and the NLTK corpora.
+
+Streamlit re-executes `app.py` on every interaction, but imported modules
+stay alive for the whole process, so anything stored here is loaded once and
+shared by every session and rerun.
+"""
+import os
+import pickle
+import threading
+import time
+
+from src import profiling
+
+
+class ResourceCache():
+    """Thread-safe cache of loaded resources with hit/miss and load-time counters.
+
+    Each entry may carry a version (e.g. a file mtime); when the version passed
+    to `get` differs from the stored one, the resource is loaded again.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+                self._stats[key] = {'hits': 0, 'misses': 0, 'load_time': 0.0, 'last_load_time': 0.0}
+            return self._locks[key]
+
+    def get(self, key, loader, version=None):
+        """Return the cached resource for `key`, calling `loader()` on a miss
+        or when `version` has changed since the last load.
+        """
+        # one lock per key, so a slow load does not block unrelated resources
+        with self._key_lock(key):
+            stats = self._stats[key]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                stats['hits'] += 1
+                return entry[1]
+
+            stats['misses'] += 1
+            start = time.perf_counter()
+            value = loader()
+            elapsed = time.perf_counter() - start
+            stats['load_time'] += elapsed
+            stats['last_load_time'] = elapsed
+            self._entries[key] = (version, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a copy of the counters as {key: {hits, misses, load_time, last_load_time}}"""
+        with self._lock:
+            return {'/'.join(map(str, key)): dict(value) for key, value in self._stats.items()}
+
+
+# Shared by everything running in this process
+CACHE = ResourceCache()
+
+SPACY_MODEL = 'pt_core_news_sm'
+
+# Pipeline components left out of the spaCy model for each use case.
+# The lemmatizer only reads lemma_, pos_, is_stop and text, so it does not
+# need the dependency parser, the sentence recognizer or the NER.
+SPACY_PROFILES = {
+    'full': [],
+    'lemmatizer': ['parser', 'senter', 'ner'],
+}
+
+
+def get_spacy(name=SPACY_MODEL, profile='full'):
+    """Load a spaCy model once per process, with the components of `profile`.
+    The 'tokenizer' profile returns the bare tokenizer of the 'lemmatizer' profile,
+    for the cases that only need token.text.
+    """
+    if profile == 'tokenizer':
+        return get_spacy(name, 'lemmatizer').tokenizer
+
+    def load():
+        import spacy
+        with profiling.stage('spacy.load'):
+            return spacy.load(name, exclude=SPACY_PROFILES[profile])
+    return CACHE.get(('spacy', name, profile), load)
+
+
+class PipelineUnpickler(pickle.Unpickler):
+    """Unpickler of the pipelines pickled by classification.ipynb, where
+    CustomPortugueseLemmatizer is defined in a notebook cell and is therefore
+    recorded as __main__.CustomPortugueseLemmatizer
+    """
+    def find_class(self, module, name):
+        if module == '__main__' and name == 'CustomPortugueseLemmatizer':
+            from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+            return CustomPortugueseLemmatizer
+        return super().find_class(module, name)
+
+
+def load_pickle(file):
+    """Load a pickled pipeline from an open binary file, whatever module runs as __main__"""
+    return PipelineUnpickler(file).load()
+
+
+def get_versioned_pipeline(code, path='pickle'):
+    """Load the pipeline `pipeline_{code}` once per process, from the slim model
+    directory written by `src.model_io` if there is one, or from the pickle otherwise.
+    The pipeline is reloaded whenever the files are modified.
+
+    return:
+        value: the pipeline and the version of the files it was loaded from,
+               which identifies it in other caches.
+    """
+    directory = f'{path}/pipeline_{code}'
+    if os.path.isdir(directory):
+        from src import model_io
+
+        version = ('slim', model_io.version(directory))
+
+        def load_slim():
+            with profiling.stage('pipeline.load'):
+                return model_io.load_pipeline(directory), version
+        return CACHE.get(('pipeline', path, code), load_slim, version=version)
+
+    filename = f'{directory}.pickle'
+    version = ('pickle', os.path.getmtime(filename))
+
+    def load():
+        with profiling.stage('pipeline.load'), open(filename, 'rb') as file:
+            return load_pickle(file), version
+    return CACHE.get(('pipeline', path, code), load, version=version)
+
+
+def get_pipeline(code, path='pickle'):
+    """The pipeline `pipeline_{code}` loaded by `get_versioned_pipeline`"""
+    return get_versioned_pipeline(code, path)[0]
+
+
+def get_compiled(code, path='pickle'):
+    """CompiledLinearScorer of the pipeline `pipeline_{code}`, rebuilt whenever the pipeline is reloaded.
+    With a slim model directory, the folded weights are memory-mapped from it.
+    """
+    pipe, version = get_versioned_pipeline(code, path)
+
+    def load():
+        from src import model_io
+        from src.compiled import CompiledLinearScorer
+
+        weights = model_io.load_weights(f'{path}/pipeline_{code}') if version[0] == 'slim' else None
+        return CompiledLinearScorer.from_pipeline(pipe, weights)
+    return CACHE.get(('compiled', path, code), load, version=version)
+
+
+def get_feature_cache(lemmatizer, maxsize=10000):
+    """FeatureCache of the lemmatized texts, shared by all the pipelines whose lemmatizers
+    have the same spaCy model and phonotactic features
+    """
+    from src.scoring import FeatureCache
+
+    key = ('features', lemmatizer.spacy_model, tuple(lemmatizer.phonotactic_features))
+    return CACHE.get(key, lambda: FeatureCache(lemmatizer, maxsize))
+
+
+# Location of the NLTK packages in the NLTK data directories, for the local check
+NLTK_RESOURCES = {
+    'wordnet': 'corpora/wordnet',
+    'omw-1.4': 'corpora/omw-1.4',
+}
+
+
+def ensure_nltk_data(*packages):
+    """Make sure the NLTK packages are installed, checking the local NLTK data
+    directories first and downloading only the missing ones, once per process
+    """
+    for package in packages:
+        def load(package=package):
+            import nltk
+            try:
+                return nltk.data.find(NLTK_RESOURCES.get(package, package))
+            except LookupError:
+                return nltk.download(package)
+        CACHE.get(('nltk', package), load)
+
+
+def stats():
+    """Hit/miss counters and load times of the process-wide cache"""
+    return CACHE.stats()
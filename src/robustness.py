@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Robustness of the classifiers to text perturbations, as in `operations.ipynb`.
+
+Every operation (word swap, gender swap, paraphrase) is applied to the test set
+of the notebooks at each intensity of a grid, and the perturbed texts are scored
+by all the classifiers. The (operation, intensity) tasks run on a process pool,
+each with a seed derived from the base seed, so the results do not depend on the
+number of workers. Accuracies and timings are written to a csv or json file.
+Run from the root of the repository, e.g.:
+
+    python -m src.robustness --dataset dataset.csv -o robustness.csv --workers 4
+
+Intensities:
+    word_swap:   fraction of the words of each text replaced by a synonym.
+    gender_swap, paraphrase: all or nothing, any intensity above 0 applies the operation.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import sys
+import time
+
+from src import resources
+from src.classify import CODES, load_scorer
+
+OPERATIONS = ('word_swap', 'gender_swap', 'paraphrase')
+# percentages of replaced words of the notebook: np.arange(0, 1, step=0.05)
+INTENSITIES = tuple(round(step * 0.05, 2) for step in range(20))
+
+
+def load_test_set(dataset='dataset.csv', limit=None):
+    """Test split of the notebooks: (texts, labels)"""
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    df = pd.read_csv(dataset, index_col='id')
+    _, X_test, _, y_test = train_test_split(df['text'], df['label'], test_size=0.25, random_state=32)
+    if limit:
+        X_test, y_test = X_test[:limit], y_test[:limit]
+    return X_test.tolist(), y_test.tolist()
+
+
+def task_seed(seed, operation, intensity):
+    """Seed of a task, derived from the base seed and independent of the worker running it"""
+    digest = hashlib.sha1(f'{seed}:{operation}:{intensity}'.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16)
+
+
+def perturb(operation, texts, intensity, seed):
+    """Apply an operation to the texts, None marking the texts it cannot transform"""
+    if intensity <= 0:
+        return list(texts)
+    if operation == 'word_swap':
+        from spacy.lang.pt.stop_words import STOP_WORDS
+        from src.operations import synonym_replacement_batch
+
+        return synonym_replacement_batch(texts, STOP_WORDS, intensity, seed)
+    if operation == 'gender_swap':
+        from src.operations import swap_gender_batch
+
+        return swap_gender_batch(texts)
+    if operation == 'paraphrase':
+        from src.paraphrase import get_paraphraser
+
+        return [back for _, back in get_paraphraser().paraphrase_batch(texts)]
+    raise ValueError(f'unknown operation {operation!r}')
+
+
+# Test set and scorer of each worker process, loaded once by `init_worker`
+_texts = None
+_labels = None
+_scorer = None
+
+
+def init_worker(texts, labels, codes, path):
+    global _texts, _labels, _scorer
+    _texts = texts
+    _labels = labels
+    _scorer = load_scorer(codes, path)
+
+
+def run_task(task):
+    """Perturb the test set and score it with every classifier: one result row per classifier"""
+    operation, intensity, seed = task
+    start = time.perf_counter()
+    perturbed = perturb(operation, _texts, intensity, seed)
+    perturb_seconds = time.perf_counter() - start
+
+    # texts that could not be transformed are dropped, as in the notebook
+    kept = [(text, label) for text, label in zip(perturbed, _labels) if text is not None]
+    texts = [text for text, _ in kept]
+    start = time.perf_counter()
+    _scorer.lemmatize(texts)
+    lemmatize_seconds = time.perf_counter() - start
+
+    rows = []
+    for code in _scorer.pipes:
+        start = time.perf_counter()
+        predictions = _scorer.predict(texts, [code])[code] if texts else []
+        correct = sum(int(prediction) == int(label) for prediction, (_, label) in zip(predictions, kept))
+        rows.append({
+            'operation': operation,
+            'intensity': intensity,
+            'classifier': code,
+            'seed': seed,
+            'texts': len(texts),
+            'dropped': len(perturbed) - len(texts),
+            'accuracy': round(correct / len(texts), 6) if texts else None,
+            'perturb_seconds': round(perturb_seconds, 4),
+            'lemmatize_seconds': round(lemmatize_seconds, 4),
+            'score_seconds': round(time.perf_counter() - start, 4),
+        })
+    return rows
+
+
+def grid(operations, intensities, seed):
+    """(operation, intensity, seed) tasks; the all-or-nothing operations only get 0 and 1"""
+    tasks = []
+    for operation in operations:
+        levels = intensities if operation == 'word_swap' else sorted({float(i > 0) for i in intensities})
+        tasks.extend((operation, intensity, task_seed(seed, operation, intensity)) for intensity in levels)
+    return tasks
+
+
+def run(texts, labels, operations=OPERATIONS, intensities=INTENSITIES, codes=CODES, path='pickle',
+        workers=1, seed=8):
+    """Run the grid and return the result rows, ordered by operation and intensity"""
+    if 'word_swap' in operations:
+        resources.ensure_nltk_data('wordnet', 'omw-1.4')
+    tasks = grid(operations, intensities, seed)
+    if workers <= 1:
+        init_worker(texts, labels, codes, path)
+        results = map(run_task, tasks)
+        return [row for rows in results for row in rows]
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(texts, labels, codes, path)) as pool:
+        # chunksize=1: the tasks are few and long
+        return [row for rows in pool.imap(run_task, tasks, chunksize=1) for row in rows]
+
+
+def write_results(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if path.endswith('.json'):
+            json.dump(rows, file, ensure_ascii=False, indent=1)
+            return
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='dataset.csv')
+    parser.add_argument('-o', '--output', default='robustness.csv', help='csv or json file for the results')
+    parser.add_argument('--operations', nargs='+', default=['word_swap', 'gender_swap'], choices=OPERATIONS)
+    parser.add_argument('--intensities', nargs='+', type=float, default=list(INTENSITIES))
+    parser.add_argument('-c', '--classifier', nargs='+', default=list(CODES), choices=CODES)
+    parser.add_argument('--models', default='pickle', help='directory of the pipelines')
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=8)
+    parser.add_argument('--limit', type=int, help='only use the first texts of the test set')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    texts, labels = load_test_set(args.dataset, args.limit)
+    rows = run(texts, labels, args.operations, args.intensities, args.classifier, args.models, args.workers,
+               args.seed)
+    write_results(rows, args.output)
+    for row in rows:
+        print(f'{row["operation"]:<12s} {row["intensity"]:5.2f} {row["classifier"]:<4s} '
+              f'accuracy {row["accuracy"]}', file=sys.stderr)
+    print(f'{len(rows)} results in {time.perf_counter() - start:.2f} s', file=sys.stderr)
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,173 @@
+"""
+Scoring of texts with several fitted classification pipelines at once.
+
+The pipelines of the notebooks (lemmatizer -> CountVectorizer -> TfidfTransformer
+-> classifier) share their most expensive stage, the spaCy lemmatization. The
+scorer lemmatizes each text once, caches the result by content hash and feeds
+it to every classifier, so NB and SVC predictions cost a single feature extraction.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Names of the writing levels predicted by the classifiers
+LEVELS = {
+    'Português': {1: 'Ensino Fundamental I', 2: 'Ensino Fundamental II', 3: 'Ensino Médio', 4: 'Ensino Superior'},
+    'English': {1: 'Elementary School I', 2: 'Elementary School II', 3: 'High School', 4: 'Higher Education'},
+}
+
+
+def level_name(level, language='Português'):
+    """Name of a predicted level, levels other than 1, 2 and 3 being shown as 4"""
+    names = LEVELS[language]
+    return names.get(int(level), names[4])
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class LRUCache():
+    """Thread-safe dict-like cache that keeps at most `maxsize` entries, evicting the least recently used"""
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries also expire `ttl` seconds after they were stored"""
+    def __init__(self, maxsize=1024, ttl=3600, clock=time.monotonic):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < self.clock():
+            with self._lock:
+                self._data.pop(key, None)
+                self.hits -= 1
+                self.misses += 1
+            return default
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, (self.clock() + self.ttl, value))
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        return entry is not None and entry[0] >= self.clock()
+
+
+class FeatureCache():
+    """Lemmatized texts (the output of CustomPortugueseLemmatizer.transform) by content hash"""
+    def __init__(self, lemmatizer, maxsize=10000):
+        self.lemmatizer = lemmatizer
+        self.cache = LRUCache(maxsize)
+
+    def transform(self, texts):
+        keys = [text_hash(text) for text in texts]
+        # the results are kept here rather than read back from the cache, which may
+        # already have evicted them when the batch has more than `maxsize` texts
+        found = {}
+        # lemmatize each missing text once, in a single nlp.pipe batch
+        missing = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            features = self.cache.get(key)
+            if features is None:
+                missing[key] = text
+            else:
+                found[key] = features
+        for key, features in zip(missing, self.lemmatizer.pipe(list(missing.values()))):
+            found[key] = features
+            self.cache[key] = features
+        return [found[key] for key in keys]
+
+
+class MultiScorer():
+    """
+    Score texts with several fitted pipelines sharing a single feature extraction.
+
+    arguments:
+        pipes: {code: Pipeline} of fitted lemmatizer -> ... -> classifier pipelines.
+               The lemmatizers are stateless, so the one of the first pipeline is used for all.
+        maxsize: number of lemmatized texts and TF-IDF matrices kept in cache.
+    """
+    def __init__(self, pipes, maxsize=10000):
+        self.pipes = dict(pipes)
+        lemmatizer = next(iter(self.pipes.values())).steps[0][1]
+        self.features = FeatureCache(lemmatizer, maxsize)
+        self.matrices = LRUCache(maxsize=32)
+        # pipelines whose vectorizer and TF-IDF are identical share their matrices
+        self._signatures = {code: self._signature(pipe) for code, pipe in self.pipes.items()}
+
+    @staticmethod
+    def _signature(pipe):
+        import pickle
+
+        return hashlib.sha1(pickle.dumps(pipe[1:-1])).hexdigest()
+
+    def lemmatize(self, texts):
+        return self.features.transform(texts)
+
+    def tfidf(self, code, texts):
+        """TF-IDF matrix of `texts` for the pipeline `code`, computed once per batch"""
+        lemmatized = self.lemmatize(texts)
+        key = (self._signatures[code], hashlib.sha1('\0'.join(lemmatized).encode('utf-8')).hexdigest())
+        matrix = self.matrices.get(key)
+        if matrix is None:
+            matrix = self.pipes[code][1:-1].transform(lemmatized)
+            self.matrices[key] = matrix
+        return matrix
+
+    def classifier(self, code):
+        return self.pipes[code].steps[-1][1]
+
+    def decision_scores(self, code, texts):
+        """Per-class scores of the classifier `code`: the decision function of linear
+        models, or the class probabilities of the others (e.g. MultinomialNB)
+        """
+        clf = self.classifier(code)
+        matrix = self.tfidf(code, list(texts))
+        if hasattr(clf, 'decision_function'):
+            return clf.decision_function(matrix)
+        return clf.predict_proba(matrix)
+
+    def predict(self, texts, codes=None):
+        """Return {code: predictions} for every pipeline (or only the ones in `codes`)"""
+        texts = list(texts)
+        return {code: self.classifier(code).predict(self.tfidf(code, texts)) for code in codes or self.pipes}
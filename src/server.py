@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Local HTTP inference service for the writing-level classifiers.
+
+The spaCy model and the pipelines are loaded once and kept warm. Concurrent
+requests are coalesced into micro-batches (up to --max-batch-size texts, waiting
+at most --max-wait-ms for the batch to fill) that are lemmatized with a single
+`nlp.pipe` call and classified with a single `predict` per classifier.
+
+    python -m src.server serve --port 8000
+    curl -d '{"text": "Era uma vez...", "classifier": "NB"}' http://127.0.0.1:8000/predict
+    curl http://127.0.0.1:8000/metrics
+    python -m src.server loadtest --port 8000 --concurrency 32 --requests 2000
+
+Endpoints:
+    POST /predict   {"text": "...", "classifier": "NB" | "SVC"} -> {"level": 1-4, "level_name": "..."}
+    GET  /metrics   latency histograms of requests, queue waits and batches
+    GET  /health    {"status": "ok"}
+
+Invalid requests and texts longer than --max-text-length get a 400, and errors
+of the classifiers a 500 with {"error": "..."}. When a batch fails, its texts
+are scored one at a time, so only the requests with a bad text fail.
+"""
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import json
+import random
+import time
+from collections import deque
+
+# Longest text accepted by /predict, the default nlp.max_length of spaCy
+MAX_TEXT_LENGTH = 1000000
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+
+class Histogram():
+    """Fixed-bucket histogram, with percentiles over the most recent samples"""
+    def __init__(self, buckets=BUCKETS_MS, window=10000):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class MicroBatcher():
+    """
+    Coalesce concurrent prediction requests into batches.
+
+    arguments:
+        scorer: MultiScorer with the pipelines of the classifiers.
+        max_batch_size: maximum number of texts in a batch.
+        max_wait_ms: maximum time the first request of a batch waits for others.
+    """
+    def __init__(self, scorer, max_batch_size=32, max_wait_ms=10):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        # a single model thread, so batches never run concurrently
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.metrics = {
+            'queue_wait_ms': Histogram(),
+            'batch_ms': Histogram(),
+            'batch_size': Histogram(buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, float('inf'))),
+        }
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        return asyncio.ensure_future(self._run())
+
+    async def predict(self, text, code):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((text, code, time.perf_counter(), future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _score(self, texts, codes):
+        """Level of each text, predicted by the classifier of its own request"""
+        # a single nlp.pipe over the batch, the classifiers then read the cached features
+        self.scorer.lemmatize(texts)
+        by_code = {}
+        for i, code in enumerate(codes):
+            by_code.setdefault(code, []).append(i)
+        levels = [None] * len(texts)
+        for code, indices in by_code.items():
+            predictions = self.scorer.predict([texts[i] for i in indices], [code])[code]
+            for i, level in zip(indices, predictions):
+                levels[i] = int(level)
+        return levels
+
+    async def _score_each(self, batch):
+        """Score the requests of a failed batch one at a time, so an error only fails its own request"""
+        loop = asyncio.get_event_loop()
+        for text, code, _, future in batch:
+            try:
+                levels = await loop.run_in_executor(self.executor, self._score, [text], [code])
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            if not future.done():
+                future.set_result(levels[0])
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self._next_batch()
+            start = time.perf_counter()
+            for _, _, enqueued, _ in batch:
+                self.metrics['queue_wait_ms'].observe((start - enqueued) * 1000)
+            texts = [text for text, _, _, _ in batch]
+            codes = [code for _, code, _, _ in batch]
+            try:
+                levels = await loop.run_in_executor(self.executor, self._score, texts, codes)
+            except Exception:
+                await self._score_each(batch)
+            else:
+                for level, (_, _, _, future) in zip(levels, batch):
+                    if not future.done():
+                        future.set_result(level)
+            self.metrics['batch_ms'].observe((time.perf_counter() - start) * 1000)
+            self.metrics['batch_size'].observe(len(batch))
+
+
+class Server():
+    """Minimal HTTP/1.1 server (keep-alive, JSON bodies) around a MicroBatcher"""
+    def __init__(self, batcher, language='Português', max_text_length=MAX_TEXT_LENGTH):
+        self.batcher = batcher
+        self.language = language
+        self.max_text_length = max_text_length
+        self.request_ms = Histogram()
+
+    @staticmethod
+    async def respond(writer, status, response, keep_alive):
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+            .encode('latin-1') + payload)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError(f'negative Content-Length {length}')
+                except ValueError:
+                    # the rest of the stream cannot be parsed, close the connection
+                    await self.respond(writer, '400 Bad Request', {'error': 'malformed request'}, False)
+                    break
+                body = await reader.readexactly(length)
+
+                try:
+                    status, response = await self.route(method, path, body)
+                except Exception as error:
+                    status, response = '500 Internal Server Error', {'error': f'{type(error).__name__}: {error}'}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        from src.scoring import level_name
+
+        if method == 'GET' and path == '/health':
+            return '200 OK', {'status': 'ok'}
+        if method == 'GET' and path == '/metrics':
+            metrics = {name: histogram.to_dict() for name, histogram in self.batcher.metrics.items()}
+            metrics['request_ms'] = self.request_ms.to_dict()
+            return '200 OK', metrics
+        if method == 'POST' and path == '/predict':
+            start = time.perf_counter()
+            try:
+                request = json.loads(body or b'{}')
+                text = request['text']
+                code = request.get('classifier', 'NB')
+                if not isinstance(text, str) or code not in self.batcher.scorer.pipes:
+                    raise ValueError
+            except (ValueError, KeyError, TypeError):
+                return '400 Bad Request', {'error': 'expected {"text": str, "classifier": one of '
+                                                    f'{sorted(self.batcher.scorer.pipes)}}}'}
+            if len(text) > self.max_text_length:
+                return '400 Bad Request', {'error': f'text longer than {self.max_text_length} characters'}
+            level = await self.batcher.predict(text, code)
+            self.request_ms.observe((time.perf_counter() - start) * 1000)
+            return '200 OK', {'level': level, 'level_name': level_name(level, self.language), 'classifier': code}
+        return '404 Not Found', {'error': f'{method} {path} not found'}
+
+
+async def serve(host, port, codes, models, max_batch_size, max_wait_ms, max_text_length=MAX_TEXT_LENGTH):
+    from src.classify import load_scorer
+
+    scorer = load_scorer(codes, models)
+    # warm up spaCy and the classifiers before accepting requests
+    scorer.predict(['Texto de aquecimento.'])
+    batcher = MicroBatcher(scorer, max_batch_size, max_wait_ms)
+    await batcher.start()
+    server = await asyncio.start_server(Server(batcher, max_text_length=max_text_length).handle, host, port)
+    print(f'Serving {", ".join(codes)} on http://{host}:{port}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+async def load_test(host, port, texts, concurrency, requests, codes):
+    """Send `requests` predictions over `concurrency` keep-alive connections and
+    return the client-side latencies (ms) and the total time (s)
+    """
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in counter:
+            body = json.dumps({'text': texts[i % len(texts)], 'classifier': codes[i % len(codes)]}).encode('utf-8')
+            start = time.perf_counter()
+            writer.write(f'POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+            await writer.drain()
+            await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - start) * 1000)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='run the inference service')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('-c', '--classifier', nargs='+', default=['NB', 'SVC'])
+    serve_parser.add_argument('--models', default='pickle', help='directory of the pipelines')
+    serve_parser.add_argument('--max-batch-size', type=int, default=32)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=10)
+    serve_parser.add_argument('--max-text-length', type=int, default=MAX_TEXT_LENGTH,
+                              help='longest text accepted, in characters')
+
+    load_parser = subparsers.add_parser('loadtest', help='load test a running service')
+    load_parser.add_argument('--host', default='127.0.0.1')
+    load_parser.add_argument('--port', type=int, default=8000)
+    load_parser.add_argument('-c', '--classifier', nargs='+', default=['NB', 'SVC'])
+    load_parser.add_argument('--dataset', help='csv dataset with the texts to send (default: generated texts)')
+    load_parser.add_argument('--concurrency', type=int, default=32)
+    load_parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        asyncio.run(serve(args.host, args.port, args.classifier, args.models, args.max_batch_size, args.max_wait_ms,
+                          args.max_text_length))
+        return
+
+    if args.dataset:
+        import csv
+        with open(args.dataset, newline='', encoding='utf-8') as file:
+            texts = [row['text'] for row in csv.DictReader(file)]
+    else:
+        rng = random.Random(0)
+        words = 'ele ela casa escola professor aluno livro estudar escrever texto bonito grande'.split()
+        texts = [' '.join(rng.choice(words) for _ in range(rng.randint(20, 200))) for _ in range(100)]
+
+    latencies, seconds = asyncio.run(load_test(args.host, args.port, texts, args.concurrency, args.requests,
+                                               args.classifier))
+    histogram = Histogram(window=len(latencies))
+    for latency in latencies:
+        histogram.observe(latency)
+    summary = histogram.to_dict()
+    print(f'{len(latencies)} requests in {seconds:.2f} s ({len(latencies) / seconds:.1f} req/s), '
+          f'latency p50 {summary["p50"]:.1f} ms, p90 {summary["p90"]:.1f} ms, p99 {summary["p99"]:.1f} ms')
+
+
+if __name__ == '__main__': main()
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Out-of-core training of the writing-level classifiers.
+
+The dataset is read in chunks, each chunk is lemmatized with the
+CustomPortugueseLemmatizer and vectorized with a stateless HashingVectorizer,
+so no vocabulary has to be fitted on the whole corpus. The document frequencies
+of the hashed terms are accumulated online to weight the chunks by TF-IDF, and
+the classifiers are updated with `partial_fit`:
+
+    NB:  MultinomialNB
+    SVC: SGDClassifier with the hinge loss, the linear SVM counterpart of LinearSVC
+
+Memory stays bounded by the chunk size and the number of hashed features,
+whatever the size of the corpus. The state of the training is checkpointed after
+every chunk; running again with the same checkpoint resumes it, skipping the
+texts (by id) it has already seen, e.g. after new labelled texts were added to
+the dataset. The seen ids are appended to a `<checkpoint>.seen` file next to the
+checkpoint, so a save only writes the ids of the new chunk. Run from the root of
+the repository, e.g.:
+
+    python -m src.streaming_training dataset.csv --checkpoint streaming.ckpt --export pickle_streaming
+
+Each chunk is scored before the classifiers learn from it, so the reported
+accuracy is a progressive (train-on-the-rest) validation. The TF-IDF weights
+of a chunk use the document frequencies seen so far; the exported pipelines
+use the final ones.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+CLASSES = (1, 2, 3, 4)
+
+
+class StreamingTrainer():
+    """
+    State of an out-of-core training: hashed document frequencies and classifiers.
+
+    arguments:
+        n_features: number of hashed features.
+        alpha: regularization of the SGD classifier.
+        smooth_idf, sublinear_tf: TF-IDF options, as in TfidfTransformer.
+        random_state: seed of the SGD classifier.
+    """
+    def __init__(self, n_features=2 ** 18, alpha=1e-4, smooth_idf=True, sublinear_tf=False, random_state=21):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.naive_bayes import MultinomialNB
+
+        self.n_features = n_features
+        self.alpha = alpha
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+        self.random_state = random_state
+        # term counts: no alternating signs and no normalization, TF-IDF is applied afterwards
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.n_documents = 0
+        self.models = {
+            'NB': MultinomialNB(),
+            'SVC': SGDClassifier(loss='hinge', alpha=alpha, random_state=random_state),
+        }
+        self.seen = set()
+        self.chunks = 0
+        self.history = []
+        # checkpoint the seen ids were last saved to, length of its valid .seen file
+        # and the ids seen since
+        self._checkpoint = None
+        self._seen_bytes = 0
+        self._unsaved = []
+
+    def idf(self):
+        """idf weights of the documents seen so far, computed as in TfidfTransformer"""
+        n_documents = self.n_documents + int(self.smooth_idf)
+        document_frequency = self.document_frequency + int(self.smooth_idf)
+        return np.log(n_documents / np.maximum(document_frequency, 1)) + 1
+
+    def tfidf(self, counts):
+        from sklearn.preprocessing import normalize
+
+        counts = counts.astype(np.float64)
+        if self.sublinear_tf:
+            np.log(counts.data, counts.data)
+            counts.data += 1
+        counts.data *= self.idf()[counts.indices]
+        return normalize(counts)
+
+    def partial_fit(self, lemmatized, labels):
+        """Update the document frequencies and the classifiers with a chunk of lemmatized texts.
+        Return the accuracy of each classifier on the chunk before the update.
+        """
+        counts = self.vectorizer.transform(lemmatized)
+        counts.sum_duplicates()
+        # the column indices of each row are distinct, so this counts documents
+        self.document_frequency += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_documents += counts.shape[0]
+        X = self.tfidf(counts)
+        y = np.asarray(labels)
+
+        accuracy = {}
+        for code, model in self.models.items():
+            if hasattr(model, 'classes_'):
+                accuracy[code] = float((model.predict(X) == y).mean())
+            model.partial_fit(X, y, classes=CLASSES)
+        return accuracy
+
+    def train(self, dataset, chunk_size=1000, checkpoint=None, max_chunks=None, batch_size=64, log=sys.stderr):
+        """Train on the texts of `dataset` not seen yet, saving a checkpoint after every chunk"""
+        import pandas as pd
+        from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+        lemmatizer = CustomPortugueseLemmatizer(batch_size=batch_size)
+        trained = 0
+        for chunk in pd.read_csv(dataset, chunksize=chunk_size, usecols=['id', 'text', 'label']):
+            if max_chunks is not None and trained >= max_chunks:
+                break
+            # duplicated ids are dropped, as in the notebook, and seen ids are skipped on resume
+            chunk = chunk[~chunk['id'].isin(self.seen) & ~chunk['id'].duplicated()]
+            if chunk.empty:
+                continue
+            start = time.perf_counter()
+            accuracy = self.partial_fit(lemmatizer.transform(chunk['text']), chunk['label'])
+            ids = chunk['id'].tolist()
+            self.seen.update(ids)
+            self._unsaved.extend(ids)
+            self.chunks += 1
+            trained += 1
+            self.history.append({'chunk': self.chunks, 'texts': len(chunk), 'accuracy': accuracy,
+                                 'seconds': time.perf_counter() - start})
+            if checkpoint:
+                self.save(checkpoint)
+            if log:
+                scores = ', '.join(f'{code} {value:.3f}' for code, value in accuracy.items())
+                print(f'chunk {self.chunks}: {len(chunk)} texts ({self.n_documents} in total) '
+                      f'in {time.perf_counter() - start:.2f} s, progressive accuracy {scores or "-"}', file=log)
+        return self
+
+    def state(self):
+        """Plain state of the training (parameters, arrays and sklearn models), without the seen ids"""
+        return {
+            'params': {'n_features': self.n_features, 'alpha': self.alpha, 'smooth_idf': self.smooth_idf,
+                       'sublinear_tf': self.sublinear_tf, 'random_state': self.random_state},
+            'document_frequency': self.document_frequency,
+            'n_documents': self.n_documents,
+            'models': self.models,
+            'chunks': self.chunks,
+            'history': self.history,
+        }
+
+    def save(self, path):
+        """
+        Checkpoint the training to `path`. The ids seen since the previous save are
+        appended to `path`.seen, one JSON value per line. The state is written
+        atomically after them, with the length of the valid part of the .seen file,
+        so an interrupted save leaves the previous checkpoint.
+        """
+        if path != self._checkpoint:
+            # first save to this checkpoint, with all the ids
+            self._checkpoint, self._seen_bytes, self._unsaved = path, 0, list(self.seen)
+        with open(f'{path}.seen', 'ab') as file:
+            # drop the ids of an interrupted save
+            file.truncate(self._seen_bytes)
+            file.seek(self._seen_bytes)
+            file.write(''.join(json.dumps(id_) + '\n' for id_ in self._unsaved).encode('utf-8'))
+            seen_bytes = file.tell()
+        with open(f'{path}.tmp', 'wb') as file:
+            pickle.dump(dict(self.state(), seen_bytes=seen_bytes), file)
+        os.replace(f'{path}.tmp', path)
+        self._seen_bytes = seen_bytes
+        self._unsaved = []
+
+    @classmethod
+    def load(cls, path):
+        """Rebuild the trainer saved to the checkpoint `path`"""
+        with open(path, 'rb') as file:
+            state = pickle.load(file)
+        trainer = cls(**state['params'])
+        trainer.document_frequency = state['document_frequency']
+        trainer.n_documents = state['n_documents']
+        trainer.models = state['models']
+        trainer.chunks = state['chunks']
+        trainer.history = state['history']
+        with open(f'{path}.seen', 'rb') as file:
+            seen = file.read(state['seen_bytes']).decode('utf-8')
+        trainer.seen = {json.loads(line) for line in seen.splitlines()}
+        trainer._checkpoint, trainer._seen_bytes = path, state['seen_bytes']
+        return trainer
+
+    def to_pipeline(self, code):
+        """sklearn Pipeline (lemmatizer -> hashing -> TF-IDF -> classifier) with the classifier `code`"""
+        import copy
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.pipeline import Pipeline
+        from src.CustomPortugueseLemmatizer import CustomPortugueseLemmatizer
+
+        tfidf = TfidfTransformer(smooth_idf=self.smooth_idf, sublinear_tf=self.sublinear_tf)
+        tfidf.idf_ = self.idf()
+        tfidf.n_features_in_ = self.n_features
+        return Pipeline([
+            ('lemmatizer', CustomPortugueseLemmatizer()),
+            ('vectorizer', copy.deepcopy(self.vectorizer)),
+            ('tfidf', tfidf),
+            ('clf', copy.deepcopy(self.models[code])),
+        ])
+
+    def export(self, path):
+        """Pickle the pipelines to `path`/pipeline_{code}.pickle, the layout read by the app"""
+        os.makedirs(path, exist_ok=True)
+        for code in self.models:
+            with open(f'{path}/pipeline_{code}.pickle', 'wb') as file:
+                pickle.dump(self.to_pipeline(code), file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataset', help='csv dataset with id, text and label columns')
+    parser.add_argument('--checkpoint', help='state of the training, resumed when it exists')
+    parser.add_argument('--export', help='directory for the pickled pipelines')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--max-chunks', type=int, help='stop after this number of chunks')
+    parser.add_argument('--n-features', type=int, default=2 ** 18)
+    parser.add_argument('--alpha', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        trainer = StreamingTrainer.load(args.checkpoint)
+        print(f'Resuming from {args.checkpoint}: {trainer.n_documents} texts in {trainer.chunks} chunks',
+              file=sys.stderr)
+    else:
+        trainer = StreamingTrainer(args.n_features, args.alpha)
+    trainer.train(args.dataset, args.chunk_size, args.checkpoint, args.max_chunks)
+    if args.export:
+        trainer.export(args.export)
+
+
+if __name__ == '__main__': main()
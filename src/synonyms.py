@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# coding: utf-8
+"""
+Precomputed synonym index of the Portuguese lemmas of the Open Multilingual WordNet.
+
+Looking up synonyms with `wordnet.synsets(word, lang='por')` traverses WordNet and
+cleans every lemma on each call. The index stores the cleaned synonyms of every
+Portuguese lemma in a gzipped tab-separated file (one lemma per line, followed by
+its synonyms), loaded once on first use and fronted by an LRU cache.
+
+Build the index from the root of the repository with:
+
+    python -m src.synonyms build
+"""
+import argparse
+import functools
+import gzip
+import os
+
+from src.profiling import timed
+
+INDEX_PATH = 'synonyms_por.tsv.gz'
+
+# Characters kept in a synonym, everything else is removed
+CHARACTERS = frozenset(' qwertyuiopasdfghjklçzxcvbnmáàãâéêíóõôúü')
+
+
+def clean_lemma(name):
+    synonym = name.replace("_", " ").replace("-", " ").lower()
+    return "".join([char for char in synonym if char in CHARACTERS])
+
+
+def wordnet_synonyms(word):
+    """
+    Get synonyms of a word straight from WordNet, including the word itself
+    """
+    from nltk.corpus import wordnet
+
+    synonyms = set()
+    for syn in wordnet.synsets(word, lang='por'):
+        for l in syn.lemmas(lang='por'):
+            synonyms.add(clean_lemma(l.name()))
+    return synonyms
+
+
+def build_index(path=INDEX_PATH):
+    """Write the synonyms of every Portuguese lemma to `path` and return the number of lemmas"""
+    from nltk.corpus import wordnet
+
+    # synsets() lowercases its argument, so lowercase lemmas are the lookup keys
+    lemmas = sorted({lemma.lower() for lemma in wordnet.all_lemma_names(lang='por')})
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        for lemma in lemmas:
+            file.write('\t'.join([lemma] + sorted(wordnet_synonyms(lemma))) + '\n')
+    return len(lemmas)
+
+
+def load_index(path=INDEX_PATH):
+    """Read an index written by `build_index` into a {lemma: synonyms} dict"""
+    index = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            index[fields[0]] = tuple(fields[1:])
+    return index
+
+
+class SynonymIndex():
+    """Synonym lookups backed by the precomputed index, loaded lazily on the
+    first lookup, or by WordNet when the index has not been built
+    """
+    def __init__(self, path=INDEX_PATH, maxsize=8192):
+        self.path = path
+        self._index = None
+        self._lookup = functools.lru_cache(maxsize=maxsize)(self._synonyms)
+
+    def _synonyms(self, word):
+        if self._index is None:
+            self._index = load_index(self.path) if os.path.exists(self.path) else {}
+            if not self._index:
+                from src.resources import ensure_nltk_data
+
+                ensure_nltk_data('wordnet', 'omw-1.4')
+        if self._index:
+            synonyms = self._index.get(word.lower(), ())
+        else:
+            synonyms = sorted(wordnet_synonyms(word))
+        return tuple(synonym for synonym in synonyms if synonym != word)
+
+    def get_synonyms(self, word):
+        """
+        Get synonyms of a word
+        """
+        return list(self._lookup(word))
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+
+# Shared by everything running in this process
+INDEX = SynonymIndex()
+
+
+@timed('synonyms.get_synonyms')
+def get_synonyms(word):
+    """
+    Get synonyms of a word
+    """
+    return INDEX.get_synonyms(word)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='build the synonym index from WordNet')
+    build.add_argument('--output', default=INDEX_PATH)
+    args = parser.parse_args()
+
+    import nltk
+    nltk.download('wordnet')
+    nltk.download('omw-1.4')
+    count = build_index(args.output)
+    print(f'Wrote the synonyms of {count} lemmas to {args.output} ({os.path.getsize(args.output) / 2**20:.2f} MiB)')
+
+
+if __name__ == '__main__': main()